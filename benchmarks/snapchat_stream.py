@@ -0,0 +1,83 @@
+"""Peak RSS of json.load vs the streaming parser on a synthetic Snapchat chat_history.json.
+
+Usage: python benchmarks/snapchat_stream.py [messages] [contacts]
+Each measurement runs in its own process so ru_maxrss is not shared (Linux/macOS only).
+"""
+import os
+import sys
+import json
+import time
+import random
+import zipfile
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MEMBER = "json/chat_history.json"
+
+
+def generate(path, nb_messages, nb_contacts):
+    random.seed(0)
+    per_contact = max(1, nb_messages // nb_contacts)
+    timestamp = 1_600_000_000_000
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as package:
+        with package.open(MEMBER, "w", force_zip64=True) as f:
+            f.write(b"{")
+            for c in range(nb_contacts):
+                contact = f"contact_{c}"
+                f.write((", " if c else "").encode() + json.dumps(contact).encode() + b": [")
+                for i in range(per_contact):
+                    timestamp += random.randint(1_000, 600_000)
+                    message = {
+                        "From": "me" if i % 2 else contact,
+                        "Media Type": "TEXT",
+                        "Created": "",
+                        "Content": "message " * random.randint(1, 8),
+                        "Conversation Title": None,
+                        "IsSender": bool(i % 2),
+                        "Created(microseconds)": timestamp,
+                        "IsSaved": False,
+                        "Media IDs": ""
+                    }
+                    f.write((b", " if i else b"") + json.dumps(message).encode())
+                f.write(b"]")
+            f.write(b"}")
+
+
+def measure(mode, path):
+    import resource
+    from src.jsonstream import iter_object_items
+    start = time.perf_counter()
+    nb = 0
+    with zipfile.ZipFile(path) as package, package.open(MEMBER) as stream:
+        if mode == "load":
+            for contact, messages in json.load(stream).items():
+                nb += len(messages)
+        else:
+            for contact, message in iter_object_items(stream):
+                nb += 1
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak //= 1024
+    print(json.dumps({"mode": mode, "messages": nb, "seconds": round(elapsed, 2), "peak_rss_mb": round(peak / 1024, 1)}))
+
+
+def main():
+    nb_messages = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000_000
+    nb_contacts = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "snapchat.zip")
+        print(f"Generating {nb_messages} messages over {nb_contacts} contacts...")
+        generate(path, nb_messages, nb_contacts)
+        print(f"Archive size: {os.path.getsize(path) / 1e6:.1f} MB")
+        for mode in ("load", "stream"):
+            subprocess.run([sys.executable, os.path.abspath(__file__), "--measure", mode, path], check=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "--measure":
+        measure(sys.argv[2], sys.argv[3])
+    else:
+        main()
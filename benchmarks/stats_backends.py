@@ -0,0 +1,66 @@
+"""Write time and output size of every stats backend on the same synthetic statistics.
+
+Usage: python benchmarks/stats_backends.py [contacts] [days] [active contacts per day]
+"""
+import os
+import sys
+import json
+import time
+import random
+import tempfile
+import contextlib
+from collections import defaultdict
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def generate(nb_contacts, nb_days, active_per_day):
+    random.seed(0)
+    contacts = [f"contact_{c}" for c in range(nb_contacts)]
+    per_contact_stats = defaultdict(list)
+    for contact in contacts:
+        you, oth = random.randint(0, 10_000), random.randint(0, 10_000)
+        per_contact_stats["Contact"].append(contact)
+        per_contact_stats["Messages"].append(you + oth)
+        per_contact_stats["Messages sent by you"].append(you)
+        per_contact_stats["Messages sent by your contact"].append(oth)
+        per_contact_stats["Characters"].append((you + oth) * 30)
+        per_contact_stats["Characters sent by you"].append(you * 30)
+        per_contact_stats["Characters sent by your contact"].append(oth * 30)
+        per_contact_stats["Your answer delay"].append(timedelta(seconds=random.randint(0, 86400)))
+        per_contact_stats["Contact answer delay"].append(timedelta(seconds=random.randint(0, 86400)))
+    first = date(2015, 1, 1).toordinal()
+    messages_per_day = {}
+    for day in range(nb_days):
+        messages_per_day[first + day] = {contact: (random.randint(0, 50), random.randint(0, 50))
+                                         for contact in random.sample(contacts, min(active_per_day, nb_contacts))}
+    hour_distribution = [random.randint(0, 100_000) for _ in range(24)]
+    return per_contact_stats, messages_per_day, hour_distribution
+
+
+def main():
+    from src.backends import BACKENDS
+    nb_contacts = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    nb_days = int(sys.argv[2]) if len(sys.argv) > 2 else 2500
+    active_per_day = int(sys.argv[3]) if len(sys.argv) > 3 else 40
+    print(f"Generating {nb_contacts} contacts over {nb_days} days ({active_per_day} active per day)...")
+    per_contact_stats, messages_per_day, hour_distribution = generate(nb_contacts, nb_days, active_per_day)
+    cwd = os.getcwd()
+    for name, backend in BACKENDS.items():
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                stats = ({key: list(values) for key, values in per_contact_stats.items()}, messages_per_day, hour_distribution)
+                start = time.perf_counter()
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                    backend(*stats, "bench")
+                elapsed = time.perf_counter() - start
+                size = sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(tmp) for f in files)
+            finally:
+                os.chdir(cwd)
+        print(json.dumps({"backend": name, "seconds": round(elapsed, 3), "size_mb": round(size / 1e6, 2)}))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,8 @@ from src.instagram import Instagram
 from src.snapchat import SnapChat
 from src.whatsapp import WhatsApp
 from src.merge_all import Merge
+from src.cache import ClearCache
+from src.warehouse import Warehouse
 
 txt_networks = [("Discord", Discord),
                 ("Instagram", Instagram),
@@ -42,6 +44,8 @@ def set_all_path():
             s_n.append(cls(path))
     if s_n:
         s_n.append(Merge(s_n))
+        s_n.append(Warehouse(s_n))
+        s_n.append(ClearCache())
     return s_n
 
 if __name__ == "__main__":
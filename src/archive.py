@@ -0,0 +1,113 @@
+import os
+import atexit
+import bisect
+import fnmatch
+import zipfile
+import threading
+
+_pool = {}
+_pool_lock = threading.Lock()
+
+
+class Archive:
+    """Read-only view of an export zip whose central directory is parsed once.
+
+    Member names are indexed in two sorted lists (names and reversed names) so
+    prefix and suffix lookups are binary searches instead of full scans of
+    infolist(). Results are returned in archive order, like ZipFile.
+    Instances are shared through open_archive(): leaving a `with` block does
+    not close the handle, the pool does it at exit.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.zip = zipfile.ZipFile(path, mode="r")
+        self.infos = {info.filename: info for info in self.zip.infolist() if not info.is_dir()}
+        self.__positions = {name: i for i, name in enumerate(self.infos)}
+        self.__names = sorted(self.infos)
+        self.__reversed = sorted(name[::-1] for name in self.infos)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    def __contains__(self, name):
+        return name in self.infos
+
+    def __len__(self):
+        return len(self.infos)
+
+    def namelist(self):
+        return list(self.infos)
+
+    def infolist(self):
+        return list(self.infos.values())
+
+    def getinfo(self, name):
+        return self.infos[name]
+
+    def open(self, member, mode="r"):
+        return self.zip.open(member, mode)
+
+    def read(self, member):
+        return self.zip.read(member)
+
+    @staticmethod
+    def __range(sorted_names, prefix):
+        # names cut to the length of the prefix are still sorted, whatever character follows it
+        start = bisect.bisect_left(sorted_names, prefix)
+        end = bisect.bisect_right(sorted_names, prefix, lo=start, key=lambda name: name[:len(prefix)])
+        return sorted_names[start:end]
+
+    def names(self, prefix="", suffix=None, contains=None, pattern=None):
+        """Member names (directories excluded) matching every given filter, in archive order."""
+        if prefix:
+            candidates = self.__range(self.__names, prefix)
+            if suffix:
+                candidates = [name for name in candidates if name.endswith(suffix)]
+        elif suffix:
+            candidates = [name[::-1] for name in self.__range(self.__reversed, suffix[::-1])]
+        else:
+            candidates = list(self.infos)
+        if contains:
+            candidates = [name for name in candidates if contains in name]
+        if pattern:
+            candidates = fnmatch.filter(candidates, pattern)
+        if prefix or suffix:
+            candidates.sort(key=self.__positions.__getitem__)
+        return candidates
+
+    def files(self, prefix="", suffix=None, contains=None, pattern=None):
+        """Same as names() but returns the ZipInfo of each member."""
+        return [self.infos[name] for name in self.names(prefix, suffix, contains, pattern)]
+
+    def close(self):
+        self.zip.close()
+
+
+def open_archive(path):
+    """Returns the pooled Archive for `path`, opening it on first use.
+
+    The pool is keyed by process id as well, so workers forked from a process
+    that already opened the archive get their own file handle.
+    """
+    key = (os.getpid(), os.path.abspath(str(path)))
+    archive = _pool.get(key)
+    if archive is None:
+        with _pool_lock:
+            archive = _pool.get(key)
+            if archive is None:
+                archive = Archive(path)
+                _pool[key] = archive
+    return archive
+
+
+@atexit.register
+def close_archives():
+    with _pool_lock:
+        for key, archive in list(_pool.items()):
+            if key[0] == os.getpid():
+                archive.close()
+            del _pool[key]
@@ -0,0 +1,116 @@
+import csv
+import json
+from datetime import date, timedelta
+
+from src.utils import generate_excel, reserve_output
+from src.settings import STATS_BACKEND
+
+STATS_FOLDER = "Stats"
+
+
+def __output_paths(name, suffixes):
+    """Free paths sharing one base name for every suffix."""
+    return reserve_output(STATS_FOLDER, name, suffixes)
+
+
+def __plain(value):
+    """Durations are written as seconds."""
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    return value
+
+
+def __contact_rows(per_contact_stats):
+    keys = list(per_contact_stats.keys())
+    for row in range(len(per_contact_stats["Contact"]) if keys else 0):
+        yield {key: __plain(per_contact_stats[key][row]) for key in keys}
+
+
+def __day_rows(messages_per_day):
+    """(ISO date, contact, nb_you, nb_oth) sorted by date then contact."""
+    for ordinal in sorted(messages_per_day):
+        day = date.fromordinal(ordinal).isoformat()
+        for contact, value in sorted(messages_per_day[ordinal].items()):
+            yield day, contact, value[0], value[1]
+
+
+def write_csv(per_contact_stats, messages_per_day, hour_distribution, name):
+    """Writes <name>_contacts.csv, <name>_days.csv and <name>_hours.csv."""
+    paths = __output_paths(name, [f"_{table}.csv" for table in ("contacts", "days", "hours")])
+    with open(paths[0], "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=list(per_contact_stats.keys()))
+        writer.writeheader()
+        writer.writerows(__contact_rows(per_contact_stats))
+    with open(paths[1], "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Date", "Contact", "Messages sent by you", "Messages sent by your contact"])
+        writer.writerows(__day_rows(messages_per_day))
+    with open(paths[2], "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Hour", "Messages"])
+        writer.writerows(enumerate(hour_distribution))
+    print(f"{', '.join(paths)} were successfully created")
+
+
+def write_jsonl(per_contact_stats, messages_per_day, hour_distribution, name):
+    """Writes <name>.jsonl, one record per line tagged with a "type" of contact, day or hour."""
+    path = __output_paths(name, [".jsonl"])[0]
+    with open(path, "w", encoding="utf-8") as f:
+        for record in __contact_rows(per_contact_stats):
+            f.write(json.dumps({"type": "contact", **record}, ensure_ascii=False) + "\n")
+        for day, contact, you, oth in __day_rows(messages_per_day):
+            f.write(json.dumps({"type": "day", "date": day, "contact": contact, "you": you, "others": oth}, ensure_ascii=False) + "\n")
+        for hour, count in enumerate(hour_distribution):
+            f.write(json.dumps({"type": "hour", "hour": hour, "messages": count}) + "\n")
+    print(f"{path} was successfully created")
+
+
+def write_columnar(per_contact_stats, messages_per_day, hour_distribution, name):
+    """Writes <name>.npz, one compressed NumPy array per column.
+
+    contact/<key> holds the per contact columns (durations in seconds), the day/
+    columns are the messages_per_day entries with dates as ordinals and contacts
+    as indexes into day/contacts, hours is the hour distribution.
+    """
+    import numpy as np
+    contacts = sorted({contact for daily in messages_per_day.values() for contact in daily})
+    contact_ids = {contact: i for i, contact in enumerate(contacts)}
+    ordinals, ids, you, oth = [], [], [], []
+    for ordinal, daily in messages_per_day.items():
+        for contact, value in daily.items():
+            ordinals.append(ordinal)
+            ids.append(contact_ids[contact])
+            you.append(value[0])
+            oth.append(value[1])
+    order = np.lexsort((ids, ordinals))
+    columns = {f"contact/{key}": np.asarray([__plain(value) for value in values]) for key, values in per_contact_stats.items()}
+    columns.update({
+        "day/contacts": np.asarray(contacts, dtype=str),
+        "day/date": np.asarray(ordinals, dtype=np.int32)[order],
+        "day/contact": np.asarray(ids, dtype=np.int32)[order],
+        "day/you": np.asarray(you, dtype=np.int64)[order],
+        "day/others": np.asarray(oth, dtype=np.int64)[order],
+        "hours": np.asarray(hour_distribution, dtype=np.int64),
+    })
+    path = __output_paths(name, [".npz"])[0]
+    with open(path, "wb") as f:
+        np.savez_compressed(f, **columns)
+    print(f"{path} was successfully created")
+
+
+BACKENDS = {
+    "excel": generate_excel,
+    "csv": write_csv,
+    "jsonl": write_jsonl,
+    "npz": write_columnar,
+}
+
+
+def write_stats(per_contact_stats, messages_per_day, hour_distribution, name, backends=STATS_BACKEND):
+    """Writes the statistics with every backend of the comma separated `backends` list (STATS_BACKEND by default)."""
+    for backend in backends.split(","):
+        backend = backend.strip().lower()
+        if backend not in BACKENDS:
+            print(f"Unknown stats backend \"{backend}\", expected one of {', '.join(BACKENDS)}")
+            continue
+        BACKENDS[backend](per_contact_stats, messages_per_day, hour_distribution, name)
@@ -0,0 +1,191 @@
+import os
+import glob
+import time
+import struct
+import shutil
+import hashlib
+import sqlite3
+import threading
+
+from src.archive import open_archive
+from src.settings import CACHE_FOLDER, DURATION_CACHE, DURATION_CACHE_MAX_ENTRIES, PARSE_CACHE
+
+PARSE_CACHE_VERSION = 2
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+class DurationCache:
+    """On-disk cache of voice note durations.
+
+    Entries are keyed by archive path, member name, CRC32 and size, so a member
+    whose content changed (new export with the same name) is probed again. The
+    table is bounded to `max_entries` rows, least recently used rows go first.
+    """
+
+    def __init__(self, path=None, max_entries=DURATION_CACHE_MAX_ENTRIES):
+        if path is None:
+            os.makedirs(CACHE_FOLDER, exist_ok=True)
+            path = os.path.join(CACHE_FOLDER, "durations.sqlite")
+        self.path = path
+        self.max_entries = max_entries
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.__db.execute("""CREATE TABLE IF NOT EXISTS durations (
+                                archive TEXT NOT NULL,
+                                member TEXT NOT NULL,
+                                crc INTEGER NOT NULL,
+                                size INTEGER NOT NULL,
+                                duration REAL NOT NULL,
+                                last_used INTEGER NOT NULL,
+                                PRIMARY KEY (archive, member, crc, size))""")
+        self.__db.execute("CREATE INDEX IF NOT EXISTS durations_last_used ON durations (last_used)")
+        self.__db.commit()
+
+    def get_many(self, archive, infos):
+        """Returns {member: duration} for the ZipInfo in `infos` that are cached."""
+        archive = os.path.abspath(str(archive))
+        found = {}
+        now = int(time.time())
+        with self.__lock:
+            for info in infos:
+                row = self.__db.execute("SELECT duration FROM durations WHERE archive=? AND member=? AND crc=? AND size=?",
+                                        (archive, info.filename, info.CRC, info.file_size)).fetchone()
+                if row is not None:
+                    found[info.filename] = row[0]
+            if found:
+                self.__db.executemany("UPDATE durations SET last_used=? WHERE archive=? AND member=?",
+                                      [(now, archive, member) for member in found])
+                self.__db.commit()
+        return found
+
+    def put_many(self, archive, items):
+        """Stores the (ZipInfo, duration) pairs of `items`, then evicts the oldest rows if needed."""
+        archive = os.path.abspath(str(archive))
+        now = int(time.time())
+        with self.__lock:
+            self.__db.executemany("INSERT OR REPLACE INTO durations VALUES (?, ?, ?, ?, ?, ?)",
+                                  [(archive, info.filename, info.CRC, info.file_size, duration, now) for info, duration in items])
+            self.__evict()
+            self.__db.commit()
+
+    def __evict(self):
+        count = self.__db.execute("SELECT COUNT(*) FROM durations").fetchone()[0]
+        if count > self.max_entries:
+            self.__db.execute("DELETE FROM durations WHERE rowid IN "
+                              "(SELECT rowid FROM durations ORDER BY last_used LIMIT ?)", (count - self.max_entries,))
+
+    def clear(self, archive=None):
+        """Invalidates the whole cache, or only the entries of one archive."""
+        with self.__lock:
+            if archive is None:
+                self.__db.execute("DELETE FROM durations")
+            else:
+                self.__db.execute("DELETE FROM durations WHERE archive=?", (os.path.abspath(str(archive)),))
+            self.__db.commit()
+
+    def close(self):
+        with self.__lock:
+            self.__db.close()
+
+
+def duration_cache():
+    """Returns this process' DurationCache, or None when DURATION_CACHE is disabled."""
+    if not DURATION_CACHE:
+        return None
+    key = os.getpid()
+    with _caches_lock:
+        if key not in _caches:
+            try:
+                _caches[key] = DurationCache()
+            except sqlite3.Error as e:
+                print(f"Duration cache disabled: {e}")
+                _caches[key] = None
+        return _caches[key]
+
+
+def __central_directory_hash(path, digest):
+    """Feeds the raw central directory of a zip to `digest`, without building any ZipInfo."""
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        f.seek(max(0, size - 65557))  # end of central directory record + max comment length
+        tail = f.read()
+        pos = tail.rfind(b"PK\x05\x06")
+        if pos != -1 and len(tail) >= pos + 22:
+            cd_size, cd_offset = struct.unpack("<II", tail[pos + 12:pos + 20])
+            if cd_size != 0xFFFFFFFF and cd_offset != 0xFFFFFFFF:
+                f.seek(cd_offset)
+                while cd_size > 0:
+                    chunk = f.read(min(cd_size, 1 << 20))
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    cd_size -= len(chunk)
+                return
+    for info in open_archive(path).infolist():  # zip64 archives: hash the parsed index instead
+        digest.update(f"{info.filename}\0{info.CRC}\0{info.file_size}\0".encode("utf-8"))
+
+
+def fingerprint(paths):
+    """Identifies the content of a package (one or several zips) from their size, mtime and central directory."""
+    digest = hashlib.sha1(f"v{PARSE_CACHE_VERSION}".encode())
+    for path in sorted(str(p) for p in paths):
+        stat = os.stat(path)
+        digest.update(f"{os.path.abspath(path)}\0{stat.st_size}\0{stat.st_mtime_ns}\0".encode("utf-8"))
+        __central_directory_hash(path, digest)
+    return digest.hexdigest()
+
+
+def __parse_cache_prefix(network, paths):
+    package_id = hashlib.sha1("\0".join(sorted(os.path.abspath(str(p)) for p in paths)).encode("utf-8")).hexdigest()[:12]
+    return os.path.join(CACHE_FOLDER, "parsed", f"{network}_{package_id}_")
+
+
+def load_parsed(network, paths):
+    """Returns the cached MessageStore of a package, or None if the package changed or was never parsed."""
+    if not PARSE_CACHE:
+        return None
+    from src.messagestore import MessageStore
+    try:
+        path = f"{__parse_cache_prefix(network, paths)}{fingerprint(paths)}.npz"
+        if os.path.exists(path):
+            return MessageStore.load(path)
+    except Exception as e:
+        print(f"Can't read the parse cache: {e}")
+    return None
+
+
+def save_parsed(network, paths, store):
+    """Stores the MessageStore of a package and drops the entries of its previous versions."""
+    if not PARSE_CACHE:
+        return
+    try:
+        prefix = __parse_cache_prefix(network, paths)
+        os.makedirs(os.path.dirname(prefix), exist_ok=True)
+        path = f"{prefix}{fingerprint(paths)}.npz"
+        for old in glob.glob(f"{glob.escape(prefix)}*.npz"):
+            if old != path:
+                os.remove(old)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            store.save(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    except Exception as e:
+        print(f"Can't write the parse cache: {e}")
+
+
+class ClearCache:
+    def __str__(self):
+        return "Clear caches (parsed packages, voice note durations)"
+
+    def start_process(self):
+        cache = _caches.pop(os.getpid(), None)
+        if cache is not None:
+            cache.close()
+        if os.path.exists(CACHE_FOLDER):
+            shutil.rmtree(CACHE_FOLDER)
+        print(f"{os.path.join(os.getcwd(), CACHE_FOLDER)} was cleared")
@@ -0,0 +1,47 @@
+import gzip
+import json
+import lzma
+
+# Extensions of the exported conversation files, see EXPORT_FORMAT in settings.py
+FORMATS = ("json", "jsonl", "jsonl.gz", "jsonl.xz")
+
+
+def conversation_name(filename):
+    """Contact of an exported conversation file, None if the file is not one."""
+    for fmt in sorted(FORMATS, key=len, reverse=True):
+        if filename.endswith(f".{fmt}"):
+            return filename[:-len(fmt) - 1]
+    return None
+
+
+def __open(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode, encoding="utf-8")
+    if path.endswith(".xz"):
+        return lzma.open(path, mode, encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def write_conversation(path, messages):
+    """Writes an iterable of message dicts in the format of the extension of `path`.
+    JSON Lines formats are written one compact object per line as the iterable is consumed."""
+    if path.endswith(".json"):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(list(messages), f, ensure_ascii=False, indent=4)
+        return
+    with __open(path, "wt") as f:
+        for message in messages:
+            f.write(json.dumps(message, ensure_ascii=False))
+            f.write("\n")
+
+
+def read_conversation(path):
+    """Yields the message dicts of an exported conversation file, whatever its format."""
+    if path.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            yield from json.load(f)
+        return
+    with __open(path, "rt") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
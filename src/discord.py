@@ -4,7 +4,43 @@ from collections import defaultdict
 from src.socialnetwork import *
 from src.settings import SKIP_CALL_PROCESS
 
+_VOICE_EVENT = b"_voice_channel"  # in the names of the join_voice_channel and leave_voice_channel events
+_EVENTS_CHUNK_SIZE = 1 << 24
+
+
+def _voice_event_lines(event_file, progress):
+    """Yields the lines of a binary events file that may be voice channel events.
+
+    The file is read in large chunks and only the lines around a bytes.find
+    hit for _VOICE_EVENT are cut out, so the analytics events that make up
+    most of the file are never split, decoded or parsed. `progress` is
+    advanced by the number of bytes read.
+    """
+    remainder = b""
+    while True:
+        chunk = event_file.read(_EVENTS_CHUNK_SIZE)
+        progress.update(len(chunk))
+        if not chunk:
+            break
+        data = remainder + chunk
+        last_newline = data.rfind(b"\n")
+        if last_newline == -1:
+            remainder = data
+            continue
+        remainder = data[last_newline + 1:]
+        position = data.find(_VOICE_EVENT, 0, last_newline)
+        while position != -1:
+            line_start = data.rfind(b"\n", 0, position) + 1
+            line_end = data.find(b"\n", position)
+            yield data[line_start:line_end]
+            position = data.find(_VOICE_EVENT, line_end, last_newline)
+    if _VOICE_EVENT in remainder:
+        yield remainder
+
+
 class Discord(SocialNetwork):
+    stats_options = {"voice": False, "delays": False}
+
     def start_process(self):
         actions = [
             Action("I want to do statistics on messages", self.messages_process),
@@ -26,32 +62,35 @@ class Discord(SocialNetwork):
         def parse_discord_timestamp(ts):
             return datetime.fromisoformat(ts.strip('"').replace("Z", "+00:00"))
         call_per_id = defaultdict(tuple)  # {rtc_connection_id: (channel_id, join_voice_channel, leave_voice_channel)}
-        event_files = [file for file in package.infolist()
-                     if "events" in file.filename
-                     and file.filename.endswith(".json")
-                     and not file.is_dir()]
-        for file in tqdm(event_files):
-            with package.open(file, "r") as event_file:
-                for raw_line in tqdm(event_file, leave=False):
-                    try:
-                        line = raw_line.decode("utf-8").strip()
-                        if not line:
-                            continue
-                        event = json.loads(line)
-                        if event["event_type"] == "join_voice_channel"  and "rtc_connection_id" in event:
-                            end = None
-                            rtc = call_per_id[event["rtc_connection_id"]]
-                            if rtc is not None and rtc != ():
-                                end = rtc[2]
-                            call_per_id[event["rtc_connection_id"]] = (event["channel_id"], parse_discord_timestamp(event["timestamp"]), end)
-                        if event["event_type"] == "leave_voice_channel" and "rtc_connection_id" in event:
-                            start = None
-                            rtc = call_per_id[event["rtc_connection_id"]]
-                            if rtc is not None and rtc != ():
-                                start = rtc[1]
-                            call_per_id[event["rtc_connection_id"]] = (event["channel_id"], start, parse_discord_timestamp(event["timestamp"]))
-                    except Exception as e:
-                        print(f"Failed to parse event: {e}")
+        event_files = package.files(suffix=".json", contains="events")
+        total_size = sum(file.file_size for file in event_files)
+        start_time = time.perf_counter()
+        with tqdm(total=total_size, unit="B", unit_scale=True, unit_divisor=1024) as progress:
+            for file in event_files:
+                with package.open(file, "r") as event_file:
+                    for raw_line in _voice_event_lines(event_file, progress):
+                        try:
+                            line = raw_line.decode("utf-8").strip()
+                            if not line:
+                                continue
+                            event = json.loads(line)
+                            if event["event_type"] == "join_voice_channel"  and "rtc_connection_id" in event:
+                                end = None
+                                rtc = call_per_id[event["rtc_connection_id"]]
+                                if rtc is not None and rtc != ():
+                                    end = rtc[2]
+                                call_per_id[event["rtc_connection_id"]] = (event["channel_id"], parse_discord_timestamp(event["timestamp"]), end)
+                            if event["event_type"] == "leave_voice_channel" and "rtc_connection_id" in event:
+                                start = None
+                                rtc = call_per_id[event["rtc_connection_id"]]
+                                if rtc is not None and rtc != ():
+                                    start = rtc[1]
+                                call_per_id[event["rtc_connection_id"]] = (event["channel_id"], start, parse_discord_timestamp(event["timestamp"]))
+                        except Exception as e:
+                            print(f"Failed to parse event: {e}")
+        elapsed = time.perf_counter() - start_time
+        if total_size:
+            print(f"Read {total_size / 1048576:.1f} MB of activity events in {elapsed:.1f} s ({total_size / 1048576 / max(elapsed, 1e-9):.1f} MB/s)")
         call_per_user = defaultdict(timedelta)  # { user: time }
         total_voice_times = timedelta(0)
         max_time = timedelta(0)
@@ -67,9 +106,7 @@ class Discord(SocialNetwork):
 
     @staticmethod
     def __get_file_and_id(package):
-        messages_files_idx = [file for file in package.infolist()
-                              if file.filename.endswith("index.json")
-                              and not file.is_dir()]
+        messages_files_idx = package.files(suffix="index.json")
         msg_file_name = "Messages"
         for msg_file in messages_files_idx: # check if "Messages/" is really the message folder
             try:
@@ -81,124 +118,64 @@ class Discord(SocialNetwork):
                 msg_file_name = msg_file.filename.split("/")[0]
             except:
                 pass
-        messages_files = [file.filename for file in package.infolist()
-                          if msg_file_name in file.filename
-                          and file.filename.endswith("/messages.json")
-                          and not file.is_dir()]
+        messages_files = package.names(suffix="/messages.json", contains=msg_file_name)
         return messages_files, channels_name_id
 
+    def __account(self, package, verbose=False):
+        account_files = package.files(suffix="user.json")
+        for acc_file in account_files:
+            try:
+                with package.open(acc_file, mode="r") as account:
+                    sections = json.load(account)
+                    pseudo = sections["username"]
+                    if verbose:
+                        date = self.__snowflake_to_date(sections["id"])
+                        creation_date = f"{date.day}/{date.month}/{date.year} at {date.hour}:{date.minute}"
+                        print(f"Your {self.__class__.__name__} account named {pseudo}, created on {creation_date}, was found")
+                    return pseudo
+            except:
+                pass
+        return None
+
+    def account_name(self, store=None):
+        with open_archive(self.path) as package:
+            return self.__account(package, verbose=True)
+
+    def iter_messages(self):
+        with open_archive(self.path) as package:
+            messages_files, channels_name_id = self.__get_file_and_id(package)
+            for filename in tqdm(messages_files):
+                contact_id = re.search(r"c(\d+)/", filename)
+                if contact_id:
+                    contact_id = contact_id.group(1)
+                if contact_id not in channels_name_id:
+                    continue
+                contact = channels_name_id[contact_id].replace("#0", "")
+                with package.open(filename, mode="r") as msg:
+                    messages = json.load(msg)
+                    for message in messages:
+                        content = message["Contents"]
+                        timestamp = (int(message["ID"]) >> 22) + 1420070400000  # snowflake to milliseconds (UTC)
+                        yield Message(contact, timestamp, "You", content, len(content) if content else 0, is_you=True)
+
     def messages_stats(self, min_messages):
+        per_contact_stats, messages_per_day, hour_distribution, excel_name = super().messages_stats(min_messages)
+        if not per_contact_stats:
+            return per_contact_stats, messages_per_day, hour_distribution, excel_name
         try:
-            with zipfile.ZipFile(self.path, mode="r") as package:
-                account_files = [file for file in package.infolist()
-                                 if file.filename.endswith("user.json")
-                                 and not file.is_dir()]
-                for acc_file in account_files:
-                    try:
-                        with package.open(acc_file, mode="r") as account:
-                            sections = json.load(account)
-                            pseudo = sections["username"]
-                            date = self.__snowflake_to_date(sections["id"])
-                            creation_date = f"{date.day}/{date.month}/{date.year} at {date.hour}:{date.minute}"
-                            print(f"Your {self.__class__.__name__} account named {pseudo}, created on {creation_date}, was found")
-                            break
-                    except:
-                        pass
-
-                messages_per_day = {}  # date: { name: (nb_you, nb_oth), name : (nb_you, nb_oth) }
-                hour_distribution = [0] * 24
-                per_contact_stats = defaultdict(list)
-
-                total_msg, total_chr = 0, 0
-                messages_files, channels_name_id = self.__get_file_and_id(package)
-                for filename in tqdm(messages_files):
-                    contact_id = re.search(r"c(\d+)/", filename)
-                    if contact_id:
-                        contact_id = contact_id.group(1)
-                    if contact_id not in channels_name_id:
-                        continue
-                    contact = channels_name_id[contact_id].replace("#0", "")
-                    with package.open(filename, mode="r") as msg:
-                        messages = json.load(msg)
-                        if min_messages > 0 and len(messages) < min_messages:
-                            continue
-                        msg_you = msg_oth = char_you = char_oth = 0
-                        for message in tqdm(messages, leave=False):
-                            # Hour distribution
-                            dt = self.__snowflake_to_date(message["ID"])
-                            date_str = dt.strftime("%d/%m/%Y")
-                            hour = dt.hour
-                            hour_distribution[hour] += 1
-                            if date_str not in messages_per_day:
-                                messages_per_day[date_str] = {}
-
-                            # Messages per day
-                            nb_you, nb_oth = messages_per_day[date_str].get(contact, (0, 0))
-                            nb_you += 1
-                            messages_per_day[date_str][contact] = (nb_you, nb_oth)
-
-                            # Number of messages and char by contact
-                            content = message["Contents"]
-                            nb_chars = len(content) if content else 0
-                            msg_you += 1
-                            char_you += nb_chars
-
-                            total_chr += nb_chars
-                            total_msg += 1
-
-                        per_contact_stats["Contact"].append(contact)
-
-                        per_contact_stats["Messages"].append(msg_you + msg_oth)
-                        per_contact_stats["Messages sent by you"].append(msg_you)
-                        per_contact_stats["Messages sent by your contact"].append(msg_oth)
-
-                        per_contact_stats["Characters"].append(char_you + char_oth)
-                        per_contact_stats["Characters sent by you"].append(char_you)
-                        per_contact_stats["Characters sent by your contact"].append(char_oth)
-                print(f"\nLoaded {total_msg} messages in total with {total_chr} characters")
-                if SKIP_CALL_PROCESS:
-                    call_per_user = {}
-                else:
+            if SKIP_CALL_PROCESS:
+                call_per_user = {}
+            else:
+                with open_archive(self.path) as package:
+                    _, channels_name_id = self.__get_file_and_id(package)
                     call_per_user = self.__voice_times_by_user(package, channels_name_id)
-                for user in per_contact_stats["Contact"]:
-                    if user not in call_per_user:
-                        per_contact_stats["Call time"].append("0h0m")
-                    else:
-                        hours, remainder = divmod(call_per_user[user].total_seconds(), 3600)
-                        minutes, _ = divmod(remainder, 60)
-                        per_contact_stats["Call time"].append(f"{int(hours)}h{int(minutes)}m")
-                return per_contact_stats, messages_per_day, hour_distribution, f"{self.__class__.__name__}_{pseudo}"
+            for user in per_contact_stats["Contact"]:
+                if user not in call_per_user:
+                    per_contact_stats["Call time"].append("0h0m")
+                else:
+                    hours, remainder = divmod(call_per_user[user].total_seconds(), 3600)
+                    minutes, _ = divmod(remainder, 60)
+                    per_contact_stats["Call time"].append(f"{int(hours)}h{int(minutes)}m")
         except Exception as e:
             print(e)
-            return {}, {}, [], f"{self.__class__.__name__}_unknown"
-
-
-    def export_process(self):
-        try:
-            with zipfile.ZipFile(self.path, mode="r") as package:
-                export_folder = self.export_JSON_folder
-                messages_files, channels_name_id = self.__get_file_and_id(package)
-                for filename in tqdm(messages_files):
-                    contact_id = re.search(r"c(\d+)/", filename)
-                    if contact_id:
-                        contact_id = contact_id.group(1)
-                    if contact_id not in channels_name_id:
-                        continue
-                    contact = channels_name_id[contact_id].replace("#0", "")
-                    with package.open(filename, mode="r") as msg:
-                        messages = json.load(msg)
-                        JSON_messages = []
-                        for message in messages:
-                            dt = self.__snowflake_to_date(message["ID"])
-                            current_msg = {
-                                "datetime": str(dt),
-                                "author": "You",
-                                "message": message["Contents"],
-                                "medias": []
-                            }
-                            JSON_messages.append(current_msg)
-                        contact = re.sub(r'[\\/:*?"<>|]', "_", contact).rstrip(" .")    # remove bad char of filename
-                        with open(f"{export_folder}/{contact}.json", 'w', encoding="utf-8") as f:
-                            json.dump(JSON_messages, f, ensure_ascii=False, indent=4)
-        except Exception as e:
-            print(e)
\ No newline at end of file
+        return per_contact_stats, messages_per_day, hour_distribution, excel_name
@@ -1,10 +1,58 @@
 from tqdm import tqdm
-from collections import defaultdict
 
 from src.socialnetwork import *
-from src.settings import SKIP_AUDIO_PROCESS
+
+INBOX = "your_instagram_activity/messages/inbox/"
+
+
+def _file_number(filename):
+    """N of a message_N.json file, so message_2.json comes before message_10.json."""
+    number = filename.rsplit("/", 1)[-1].rsplit(".", 1)[0].rsplit("_", 1)[-1]
+    return int(number) if number.isdigit() else 0
+
+
+def _read_conversation(path, filename):
+    with open_archive(path) as package:
+        with package.open(filename, "r") as msg:
+            contact = filename.replace(INBOX, "").rsplit('/', 1)[0].rsplit('_', 1)[0]
+            return contact, json.load(msg)["messages"]
+
+
+def _conversation_messages(path, filename):
+    contact, messages = _read_conversation(path, filename)
+    for message in messages:
+        content = message.get("content", "")
+        medias = []
+        for vid in message.get("videos", []):
+            medias.append(vid["uri"])
+        for pic in message.get("photos", []):
+            medias.append(pic["uri"])
+        for audio_file in message.get("audio_files", []):
+            medias.append(audio_file["uri"])
+        notes = [(path, audio_file["uri"]) for audio_file in message.get("audio_files", [])]
+        yield Message(contact, local_timestamp(int(message["timestamp_ms"]) // 1000), message["sender_name"],
+                      content, len(content), tuple(medias), tuple(notes), "content" in message)
+
+
+def _parse_conversation(path, filename):
+    """Worker of Instagram.parse_messages: one conversation file to a MessageStore."""
+    return MessageStore().extend(_conversation_messages(path, filename))
+
+
+def _conversation_medias(path, filename):
+    """Worker of Instagram.medias_process: (contact, [(uri, timestamp in seconds, sender)]) of the videos and photos of a file."""
+    contact, messages = _read_conversation(path, filename)
+    medias = []
+    for message in messages:
+        timestamp_ms = int(message["timestamp_ms"]) // 1000
+        for media in message.get("videos", []) + message.get("photos", []):
+            medias.append((media["uri"], timestamp_ms, message["sender_name"]))
+    return contact, medias
+
 
 class Instagram(SocialNetwork):
+    stats_options = {"count_text_only": True}
+
     def start_process(self):
         actions = [
             Action("I want to do statistics on messages", self.messages_process),
@@ -15,218 +63,84 @@ class Instagram(SocialNetwork):
         selected = ask(f"What do you want to do with your {self.__class__.__name__} package?", actions)
         selected.execute()
 
-    def messages_stats(self, min_messages):
-        try:
-            with zipfile.ZipFile(self.path, mode="r") as package:
-                with package.open("personal_information/personal_information/personal_information.json", mode="r") as account:
-                    sections = json.load(account)
-                    pseudo = sections["profile_user"][0]["string_map_data"]["Name"]["value"]
-
-                with package.open("security_and_login_information/login_and_profile_creation/signup_details.json", mode="r") as account:
-                    sections = json.load(account)
-                    creation_date = datetime.fromtimestamp(sections["account_history_registration_info"][0]["string_map_data"]["Time"]["timestamp"])
-                print(f"Your {self.__class__.__name__} account named {pseudo}, created on {creation_date}, was found")
-
-                messages_per_day = {}  # date: { name: (nb_you, nb_oth), name : (nb_you, nb_oth) }
-                hour_distribution = [0] * 24
-                per_contact_stats = defaultdict(list)
-
-                total_msg, total_chr = 0, 0
-                msg_files = [file for file in package.infolist()
-                             if file.filename.startswith("your_instagram_activity/messages/inbox")
-                             and file.filename.endswith(".json")
-                             and not file.is_dir()]
-                for file in tqdm(msg_files):
-                    with package.open(file, "r") as msg:
-                        contact = file.filename.replace("your_instagram_activity/messages/inbox/", "").rsplit('/', 1)[0].rsplit('_', 1)[0]
-                        chat = json.load(msg)
-                        messages = chat["messages"]
-
-                        if min_messages > 0 and len(messages) < min_messages:
-                            continue
-
-                        msg_you = msg_oth = char_you = char_oth = voice_you = voice_oth = 0
-                        delays_you, delays_oth = [], []
-                        last_sender = None
-                        last_timestamp = None
-                        for message in tqdm(messages, leave=False):
-                            is_you = message["sender_name"] == pseudo
-
-                            # Hour distribution
-                            timestamp_ms = int(message["timestamp_ms"]) // 1000
-                            dt = datetime.fromtimestamp(timestamp_ms)
-                            date_str = dt.strftime("%d/%m/%Y")
-                            hour = dt.hour
-                            if is_you:
-                                hour_distribution[hour] += 1
-                            if date_str not in messages_per_day:
-                                messages_per_day[date_str] = {}
-
-                            # Messages per day
-                            nb_you, nb_oth = messages_per_day[date_str].get(contact, (0, 0))
-                            if is_you:
-                                nb_you += 1
-                            else:
-                                nb_oth += 1
-                            messages_per_day[date_str][contact] = (nb_you, nb_oth)
-
-                            # Number of messages and char by contact
-                            if "content" in message:
-                                content = message["content"]
-                                nb_chars = len(content)
-                                if is_you:
-                                    msg_you += 1
-                                    char_you += nb_chars
-                                else:
-                                    msg_oth += 1
-                                    char_oth += nb_chars
-
-                            # Voice message time
-                            if "audio_files" in message:
-                                for audio_file in message["audio_files"]:
-                                    if SKIP_AUDIO_PROCESS:
-                                        duration = 0
-                                    else:
-                                        duration = get_mp4_duration(self.path, audio_file["uri"])
-                                    if is_you:
-                                        voice_you += duration
-                                    else:
-                                        voice_oth += duration
-
-                            # Message delay
-                            if last_sender is not None and last_sender != is_you and last_timestamp is not None:
-                                delay = abs(dt - last_timestamp)
-                                if is_you:
-                                    delays_you.append(delay)
-                                else:
-                                    delays_oth.append(delay)
-                            last_sender = is_you
-                            last_timestamp = dt
-
-                            total_chr += nb_chars
-                            total_msg += 1
-                        avg_delay_you = sum(delays_you, timedelta()) / len(delays_you) if delays_you else timedelta(0)
-                        avg_delay_oth = sum(delays_oth, timedelta()) / len(delays_oth) if delays_oth else timedelta(0)
-
-                        per_contact_stats["Contact"].append(contact)
-
-                        per_contact_stats["Messages"].append(msg_you + msg_oth)
-                        per_contact_stats["Messages sent by you"].append(msg_you)
-                        per_contact_stats["Messages sent by your contact"].append(msg_oth)
-
-                        per_contact_stats["Characters"].append(char_you + char_oth)
-                        per_contact_stats["Characters sent by you"].append(char_you)
-                        per_contact_stats["Characters sent by your contact"].append(char_oth)
-
-                        per_contact_stats["Voice message time"].append(timedelta(seconds=voice_you + voice_oth))
-                        per_contact_stats["Your voice message time"].append(timedelta(seconds=voice_you))
-                        per_contact_stats["Contact voice message time"].append(timedelta(seconds=voice_oth))
-
-                        per_contact_stats["Your answer delay"].append(avg_delay_you)
-                        per_contact_stats["Contact answer delay"].append(avg_delay_oth)
-
-                print(f"\nLoaded {total_msg} messages in total with {total_chr} characters")
-                return per_contact_stats, messages_per_day, hour_distribution, f"{self.__class__.__name__}_{pseudo}"
-        except Exception as e:
-            print(e)
-            return {}, {}, [], f"{self.__class__.__name__}_unknown"
-
-    def export_process(self):
-        try:
-            with zipfile.ZipFile(self.path, mode="r") as package:
-                export_folder = self.export_JSON_folder
-                msg_files = [file for file in package.infolist()
-                             if file.filename.startswith("your_instagram_activity/messages/inbox")
-                             and file.filename.endswith(".json")
-                             and not file.is_dir()]
-                for file in tqdm(msg_files):
-                    with package.open(file, "r") as msg:
-                        contact = file.filename.replace("your_instagram_activity/messages/inbox/", "").rsplit('/', 1)[0].rsplit('_',1)[0]
-                        chat = json.load(msg)
-                        JSON_messages = []
-
-                        messages = chat["messages"]
-                        for message in messages:
-                            timestamp_ms = int(message["timestamp_ms"]) // 1000
-                            dt = datetime.fromtimestamp(timestamp_ms)
-                            medias = []
-                            content = ""
-                            if "content" in message:
-                                content = message["content"]
-                            if "videos" in message:
-                                for vid in message["videos"]:
-                                    medias.append(vid["uri"])
-                            if "photos" in message:
-                                for pic in message["photos"]:
-                                    medias.append(pic["uri"])
-                            if "audio_files" in message:
-                                for audio_file in message["audio_files"]:
-                                    medias.append(audio_file["uri"])
-                            current_msg = {
-                                "datetime": str(dt),
-                                "author": message["sender_name"],
-                                "message": content,
-                                "medias": medias
-                            }
-                            JSON_messages.append(current_msg)
-                        with open(f"{export_folder}/{contact}.json", 'w', encoding="utf-8") as f:
-                            json.dump(JSON_messages, f, ensure_ascii=False, indent=4)
-        except Exception as e:
-            print(e)
-
-    @staticmethod
-    def __move_file(path, timestamp_ms, contact, export_folder, package, send, res):
-        ext = os.path.splitext(path)[1]
-        if ext == "":
-            ext = ".jpg"
-        dt = datetime.fromtimestamp(timestamp_ms)
-
-        counter = 1
-        base_name = dt.strftime("%Y-%m-%d %H.%M.%S")
-        new_filename = f"{base_name}_{contact}{ext}"
-        out_path = os.path.join(export_folder, new_filename)
-        while os.path.exists(out_path):
-            new_filename = f"{base_name}_{contact}_{counter}{ext}"
-            out_path = os.path.join(export_folder, new_filename)
-            counter += 1
-        with package.open(path) as source_file, open(out_path, "wb") as target_file:
-            data = source_file.read()
-            target_file.write(data)
-        add_metadata(out_path, dt, ext, contact, send, res)
+    def account_name(self, store=None):
+        with open_archive(self.path) as package:
+            with package.open("personal_information/personal_information/personal_information.json", mode="r") as account:
+                sections = json.load(account)
+                pseudo = sections["profile_user"][0]["string_map_data"]["Name"]["value"]
+
+            with package.open("security_and_login_information/login_and_profile_creation/signup_details.json", mode="r") as account:
+                sections = json.load(account)
+                creation_date = datetime.fromtimestamp(sections["account_history_registration_info"][0]["string_map_data"]["Time"]["timestamp"])
+            print(f"Your {self.__class__.__name__} account named {pseudo}, created on {creation_date}, was found")
+        return pseudo
+
+    def __conversation_files(self):
+        with open_archive(self.path) as package:
+            filenames = package.names(prefix=INBOX, suffix=".json")
+        folders = {}  # conversation folder: rank in the archive
+        for filename in filenames:
+            folders.setdefault(filename.rsplit("/", 1)[0], len(folders))
+        filenames.sort(key=lambda filename: (folders[filename.rsplit("/", 1)[0]], _file_number(filename)))
+        return [(self.path, filename) for filename in filenames]
+
+    def iter_messages(self):
+        for path, filename in tqdm(self.__conversation_files()):
+            yield from _conversation_messages(path, filename)
+
+    def parse_messages(self):
+        store = MessageStore()
+        for part in parallel_map(_parse_conversation, self.__conversation_files()):
+            store.merge(part)
+        return store
 
     def medias_process(self):
         try:
-            with zipfile.ZipFile(self.path, mode="r") as package:
+            with open_archive(self.path) as package:
                 export_folder = self.export_MEDIA_folder
                 with package.open("personal_information/personal_information/personal_information.json", mode="r") as account:
                     sections = json.load(account)
                     pseudo = sections["profile_user"][0]["string_map_data"]["Name"]["value"]
-                nb = 0
-                msg_files = [file for file in package.infolist()
-                             if file.filename.startswith("your_instagram_activity/messages/inbox")
-                             and file.filename.endswith(".json")
-                             and not file.is_dir()]
-                for file in tqdm(msg_files):
-                    with package.open(file, "r") as msg:
-                        contact = file.filename.replace("your_instagram_activity/messages/inbox/", "").rsplit('/', 1)[0].rsplit('_', 1)[0]
-                        chat = json.load(msg)
-                        messages = chat["messages"]
-                        for message in messages:
-                            send = contact
-                            res = pseudo
-                            if message["sender_name"] == pseudo:
-                                send = pseudo
-                                res = contact
-                            timestamp_ms = int(message["timestamp_ms"]) // 1000
-
-                            if "videos" in message:
-                                for vid in message["videos"]:
-                                    self.__move_file(vid["uri"], timestamp_ms, contact, export_folder, package, send, res)
-                                    nb += 1
-                            if "photos" in message:
-                                for pic in message["photos"]:
-                                    self.__move_file(pic["uri"], timestamp_ms, contact, export_folder, package, send, res)
-                                    nb += 1
+                medias = []  # (uri, timestamp in seconds, contact, sender, receiver)
+                for contact, conversation_medias in parallel_map(_conversation_medias, self.__conversation_files()):
+                    for uri, timestamp_ms, sender_name in conversation_medias:
+                        send = contact
+                        res = pseudo
+                        if sender_name == pseudo:
+                            send = pseudo
+                            res = contact
+                        medias.append((uri, timestamp_ms, contact, send, res))
+
+                manifest = MediaManifest(export_folder)
+                medias = [media for media in medias if not manifest.is_exported(self.path, media[0])]
+                names = FilenameAllocator(export_folder)
+                duplicates = MediaDeduplicator(manifest.exported)
+                for media in medias:
+                    duplicates.add(self.path, media[0])
+
+                def extract(media):
+                    with package.open(media[0]) as source_file:
+                        data = source_file.read()
+                    duplicates.digest(self.path, media[0], data)
+                    return data
+
+                def allocate(media, data):
+                    uri, timestamp_ms, contact = media[:3]
+                    if duplicates.is_duplicate(self.path, uri):
+                        manifest.record(self.path, uri, digest=duplicates.digest_of(self.path, uri))
+                        return None
+                    ext = os.path.splitext(uri)[1] or ".jpg"
+                    base_name = datetime.fromtimestamp(timestamp_ms).strftime("%Y-%m-%d %H.%M.%S")
+                    return names.allocate(f"{base_name}_{contact}", ext)
+
+                def write(media, data, out_path):
+                    uri, timestamp_ms, contact, send, res = media
+                    write_media(out_path, data, datetime.fromtimestamp(timestamp_ms), os.path.splitext(uri)[1] or ".jpg", contact, send, res)
+                    manifest.record(self.path, uri, out_path, duplicates.digest_of(self.path, uri))
+
+                nb = run_pipeline(medias, extract, allocate, write)
+                duplicates.report()
+                manifest.close()
                 print(f"\n{nb} media exported in {os.path.join(os.getcwd(), export_folder)}")
         except Exception as e:
             print(e)
\ No newline at end of file
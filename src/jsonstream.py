@@ -0,0 +1,111 @@
+import io
+import re
+import json
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_NUMBER_CHARS = "0123456789.eE+-"
+_ITEM_SEPARATOR = re.compile(r"[ \t\n\r]*([,\]])[ \t\n\r]*")
+
+
+class _ObjectStream:
+    """Incremental reader for a top-level JSON object of the form {key: [item, item, ...], ...}.
+
+    Only the current item (and a read buffer) is kept in memory: keys and array
+    items are decoded one at a time with the C scanner of JSONDecoder while the
+    underlying stream is read in chunks.
+    """
+
+    def __init__(self, stream, chunk_size=1 << 20):
+        if not isinstance(stream, io.TextIOBase):
+            stream = io.TextIOWrapper(stream, encoding="utf-8")
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.scan = json.JSONDecoder().scan_once
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def __fill(self):
+        if self.eof:
+            return False
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        if self.pos:
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+        self.buf += chunk
+        return True
+
+    def __peek(self):
+        """Skips whitespace and returns the next character ('' at the end of the stream)."""
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.__fill():
+                return ""
+
+    def __expect(self, chars):
+        char = self.__peek()
+        if char == "" or char not in chars:
+            raise ValueError(f"Malformed JSON: expected one of {chars!r} at offset {self.pos}, got {char!r}")
+        self.pos += 1
+        return char
+
+    def __value(self):
+        if self.pos >= len(self.buf) or self.buf[self.pos] in " \t\n\r":
+            self.__peek()
+        while True:
+            try:
+                value, end = self.scan(self.buf, self.pos)
+                # a number touching the end of the buffer may continue in the next chunk
+                complete = not isinstance(value, (int, float)) or isinstance(value, bool) \
+                    or (end < len(self.buf) and self.buf[end] not in _NUMBER_CHARS)
+                if complete or self.eof:
+                    self.pos = end
+                    return value
+            except (StopIteration, json.JSONDecodeError):
+                if self.eof:
+                    raise ValueError(f"Malformed JSON at offset {self.pos}")
+            if not self.__fill():
+                return self.__value()
+
+    def items(self):
+        self.__expect("{")
+        if self.__peek() == "}":
+            return
+        while True:
+            key = self.__value()
+            self.__expect(":")
+            if self.__peek() == "[":
+                self.pos += 1
+                if self.__peek() == "]":
+                    self.pos += 1
+                    yield key, None, True
+                else:
+                    while True:
+                        yield key, self.__value(), False
+                        # fast path: separator and the whitespace around it are already buffered
+                        separator = _ITEM_SEPARATOR.match(self.buf, self.pos)
+                        if separator and separator.end() < len(self.buf):
+                            self.pos = separator.end()
+                            if separator.group(1) == "]":
+                                break
+                        elif self.__expect(",]") == "]":
+                            break
+            else:
+                yield key, self.__value(), True
+            if self.__expect(",}") == "}":
+                return
+
+
+def iter_object_items(stream):
+    """Yields (key, item) for every item of every array value of a top-level JSON object.
+    Values that are not arrays are yielded whole, empty arrays yield nothing."""
+    for key, item, whole in _ObjectStream(stream).items():
+        if not whole:
+            yield key, item
+        elif item is not None:
+            yield key, item
\ No newline at end of file
@@ -0,0 +1,154 @@
+import os
+import time
+
+import numpy as np
+
+from src.utils import lazy_import
+from src.settings import MAP_MODE, MAP_SIMPLIFY_TOLERANCE
+
+EARTH_RADIUS = 6371000  # metres
+MAP_MODES = ("clustered", "detailed")
+PERIOD_UNITS = {"year": "Y", "month": "M"}
+
+# Same look as the markers of the detailed map, drawn by the cluster layer only when they are visible
+_MARKER_CALLBACK = """function (row) {
+    var marker = L.circleMarker(new L.LatLng(row[0], row[1]), {radius: 4, color: "blue", fill: true, fillColor: "blue"});
+    marker.bindTooltip(row[2]);
+    return marker;
+}"""
+
+
+def _parse_coord(coord_s):
+    try:
+        parts = coord_s.split(",")
+        lat_str = parts[0].split("±")[0].strip()
+        lon_str = parts[1].split("±")[0].strip()
+        return float(lat_str), float(lon_str)
+    except Exception as e:
+        print(f"Failed to parse {coord_s}: {e}")
+        return np.nan, np.nan
+
+
+def parse_locations(rows):
+    """(timestamps, lats, lons, originals) arrays of Snapchat location rows, sorted by timestamp.
+
+    Rows are [date, "lat ± x meters, lon ± y meters"]. Dates are cut to
+    "YYYY-MM-DD HH:MM:SS" (UTC) and converted to datetime64[s] at once, the
+    coordinates are split with NumPy string operations. Rows are only parsed
+    one by one when a coordinate is malformed, and are left out if so.
+    """
+    if not rows:
+        return np.zeros(0, dtype="datetime64[s]"), np.zeros(0), np.zeros(0), np.zeros(0, dtype=str)
+    dates, coords = zip(*rows)
+    timestamps = np.asarray(dates, dtype="<U19").astype("datetime64[s]")
+    coords = np.asarray(coords, dtype=str)
+    try:
+        lats = np.char.partition(coords, "±")[:, 0].astype(np.float64)
+        lons = np.char.partition(np.char.partition(coords, ",")[:, 2], "±")[:, 0].astype(np.float64)
+    except ValueError:
+        lats, lons = np.array([_parse_coord(coord_s) for coord_s in coords.tolist()], dtype=np.float64).T
+    valid = ~(np.isnan(lats) | np.isnan(lons))
+    timestamps, lats, lons, coords = timestamps[valid], lats[valid], lons[valid], coords[valid]
+    order = np.argsort(timestamps, kind="stable")
+    return timestamps[order], lats[order], lons[order], coords[order]
+
+
+def period_windows(timestamps, period):
+    """Yields (label, start, end) slices of the sorted timestamps for every year or month that has points.
+    The bounds of all the periods are found with a single binary search."""
+    unit = PERIOD_UNITS[period]
+    bounds = np.arange(timestamps[0].astype(f"datetime64[{unit}]"), timestamps[-1].astype(f"datetime64[{unit}]") + 2)
+    edges = np.searchsorted(timestamps, bounds.astype("datetime64[s]")).tolist()
+    for label, start, end in zip(bounds[:-1].astype(str).tolist(), edges[:-1], edges[1:]):
+        if end > start:
+            yield label, start, end
+
+
+def range_window(timestamps, start=None, end=None):
+    """(start, end) slice of the sorted timestamps between two inclusive datetimes, None for no limit."""
+    first = 0 if start is None else int(np.searchsorted(timestamps, np.datetime64(start, "s"), side="left"))
+    last = len(timestamps) if end is None else int(np.searchsorted(timestamps, np.datetime64(end, "s"), side="right"))
+    return first, max(first, last)
+
+
+def simplify_track(lats, lons, tolerance=MAP_SIMPLIFY_TOLERANCE):
+    """Indices of the points of a track kept by the Douglas-Peucker algorithm.
+
+    Points are projected on a plane tangent at the mean latitude, so the
+    tolerance is the maximal distance in metres between the simplified line
+    and a dropped point. The recursion is unrolled on a stack and every
+    segment is measured with a single NumPy operation.
+    """
+    lats, lons = np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64)
+    n = len(lats)
+    if n < 3 or tolerance <= 0:
+        return np.arange(n)
+    x = np.radians(lons) * np.cos(np.radians(lats.mean())) * EARTH_RADIUS
+    y = np.radians(lats) * EARTH_RADIUS
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        dx, dy = x[end] - x[start], y[end] - y[start]
+        px, py = x[start + 1:end] - x[start], y[start + 1:end] - y[start]
+        length = np.hypot(dx, dy)
+        distances = np.abs(dx * py - dy * px) / length if length else np.hypot(px, py)
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            farthest += start + 1
+            keep[farthest] = True
+            stack.append((start, farthest))
+            stack.append((farthest, end))
+    return np.flatnonzero(keep)
+
+
+def __detailed_map(m, folium, dates, lats, lons, originals):
+    for i, (dt, lat, lon, orig) in enumerate(zip(dates, lats.tolist(), lons.tolist(), originals), start=1):
+        popup_html = f"<b>{dt.isoformat()}</b><br/>{orig}"
+        folium.CircleMarker(
+            location=[lat, lon],
+            radius=4,
+            color="blue",
+            fill=True,
+            fill_color="blue",
+            popup=folium.Popup(popup_html, max_width=300),
+            tooltip=f"{i}. {dt.strftime('%Y-%m-%d %H:%M:%S')}"
+        ).add_to(m)
+    folium.PolyLine(np.column_stack((lats, lons)).tolist(), color="red", weight=3, opacity=0.8).add_to(m)
+    return len(lats)
+
+
+def __clustered_map(m, folium, dates, lats, lons, tolerance):
+    plugins = lazy_import("folium.plugins")
+    lats, lons = np.round(lats, 6), np.round(lons, 6)  # ~10 cm, keeps the HTML small
+    rows = [[lat, lon, f"{i}. {dt.strftime('%Y-%m-%d %H:%M:%S')}"]
+            for i, (dt, lat, lon) in enumerate(zip(dates, lats.tolist(), lons.tolist()), start=1)]
+    plugins.FastMarkerCluster(rows, callback=_MARKER_CALLBACK, name="Locations").add_to(m)
+    kept = simplify_track(lats, lons, tolerance)
+    folium.PolyLine(np.column_stack((lats[kept], lons[kept])).tolist(), color="red", weight=3, opacity=0.8).add_to(m)
+    return len(kept)
+
+
+def render_map(path, dates, lats, lons, originals=None, mode=MAP_MODE, tolerance=MAP_SIMPLIFY_TOLERANCE):
+    """Saves the map of a sorted location history to `path` and reports its generation time and size.
+
+    The "detailed" mode draws one marker with a popup per point and a line
+    through all of them. The "clustered" mode puts every point in a single
+    FastMarkerCluster layer and draws the line simplified with `tolerance`
+    metres, which keeps the HTML small enough for years of history.
+    """
+    folium = lazy_import("folium")
+    start = time.perf_counter()
+    lats, lons = np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64)
+    m = folium.Map(location=[float(lats[0]), float(lons[0])], zoom_start=6)
+    if mode == "detailed":
+        line_points = __detailed_map(m, folium, dates, lats, lons, [""] * len(lats) if originals is None else originals)
+    else:
+        line_points = __clustered_map(m, folium, dates, lats, lons, tolerance)
+    m.save(path)
+    elapsed = time.perf_counter() - start
+    print(f"Map successfully saved to {os.path.join(os.getcwd(), path)}")
+    print(f"{len(lats)} points, {line_points} in the line, {os.path.getsize(path) / 1048576:.1f} MB generated in {elapsed:.1f} s")
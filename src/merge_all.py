@@ -2,6 +2,16 @@ import csv
 from functools import partial
 from src.socialnetwork import *
 from src.discord import Discord
+from src.settings import MERGE_WORKERS
+
+
+def _package_stats(package, min_messages):
+    """Worker of Merge: statistics and workbook of one package."""
+    stats = package.messages_stats(min_messages)
+    per_contact_stats, messages_per_day, hour_distribution, excel_name = stats
+    write_stats(per_contact_stats, messages_per_day, hour_distribution, excel_name)
+    return stats
+
 
 class Merge:
     all_stats = []
@@ -17,22 +27,14 @@ class Merge:
             ask("Have you completed the merge_map.csv file that allows you to merge people who have different usernames between social networks?", ["Yes", "No"])
         else:
             print("If you haven't done so, you can complete the merge_map.csv file, which allows you to merge people who have different usernames between social networks.")
+        packages = [package for package in self.packages if isinstance(package, SocialNetwork)]
         min_msg_all = []
-        for package in self.packages:
-            if isinstance(package, SocialNetwork):
-                min_msg_all.append(ask_number(f"Minimum number of messages per contact for \"{package}\" (0 for no limit set)?"))
-        all_stats = []
-        only_your_msg_chat = 0
-        pos = 0
-        for package in self.packages:
-            if isinstance(package, SocialNetwork):
-                all_stats.append(package.messages_stats(min_msg_all[pos]))
-                pos += 1
-            if isinstance(package, Discord):
-                only_your_msg_chat += 1
-        for stats in all_stats:
-            per_contact_stats, messages_per_day, hour_distribution, excel_name = stats
-            generate_excel(per_contact_stats, messages_per_day, hour_distribution, excel_name)
+        for package in packages:
+            min_msg_all.append(ask_number(f"Minimum number of messages per contact for \"{package}\" (0 for no limit set)?"))
+        for package in packages:
+            package.prepare_stats()  # nothing is interactive after this point
+        only_your_msg_chat = sum(1 for package in packages if isinstance(package, Discord))
+        all_stats = list(parallel_map(_package_stats, zip(packages, min_msg_all), MERGE_WORKERS))
         mapping = self.__load_merge_mapping("merge_map.csv")
         if len(all_stats) >= 2 and len(all_stats) != only_your_msg_chat:
             actions = [
@@ -44,7 +46,7 @@ class Merge:
             selected.execute()
         else:
             per_contact_stats, messages_per_day, hour_distribution = self.__merge_all_stats(all_stats, mapping)
-            generate_excel(per_contact_stats, messages_per_day, hour_distribution, "merge")
+            write_stats(per_contact_stats, messages_per_day, hour_distribution, "merge")
 
     def __load_merge_mapping(self, filepath="merge_map.csv"):
         mapping = []
@@ -66,7 +68,7 @@ class Merge:
                 for user, value in user_msg.items():
                     stats[1][date][user] = (value[0], 0)
         per_contact_stats, messages_per_day, hour_distribution = self.__merge_all_stats(all_stats, mapping)
-        generate_excel(per_contact_stats, messages_per_day, hour_distribution, "merge")
+        write_stats(per_contact_stats, messages_per_day, hour_distribution, "merge")
 
     def __make_estimation(self, all_stats, mapping):
         your_msg = 0
@@ -89,12 +91,12 @@ class Merge:
                         stats[0]["Messages sent by your contact"][i] = int(stats[0]["Messages sent by you"][i] * average)
                         stats[0]["Messages"][i] = stats[0]["Messages sent by you"][i] + stats[0]["Messages sent by your contact"][i]
         per_contact_stats, messages_per_day, hour_distribution = self.__merge_all_stats(all_stats, mapping)
-        generate_excel(per_contact_stats, messages_per_day, hour_distribution, "merge")
+        write_stats(per_contact_stats, messages_per_day, hour_distribution, "merge")
 
 
     def __keep_all(self, all_stats, mapping):
         per_contact_stats, messages_per_day, hour_distribution = self.__merge_all_stats(all_stats, mapping)
-        generate_excel(per_contact_stats, messages_per_day, hour_distribution, "merge")
+        write_stats(per_contact_stats, messages_per_day, hour_distribution, "merge")
 
     def __merge_all_stats(self, all_stats, mapping):
         merged_stats = all_stats[0]
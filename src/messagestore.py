@@ -0,0 +1,205 @@
+import json
+import time
+import calendar
+import numpy as np
+from array import array
+from collections import namedtuple, defaultdict
+from datetime import datetime, timedelta
+
+# One normalized message as produced by the parsers of every network.
+#   timestamp: naive local time, in milliseconds since 1970-01-01 (see local_timestamp)
+#   chars: characters counted in the statistics (may differ from len(text))
+#   medias: URIs/ids of the attached medias, in the order of the export
+#   notes: voice notes to measure, as (archive path, member) pairs
+#   has_text: False for messages without any text part (some networks only count those)
+#   is_you: whether you sent it when the export tells so, None to compare the author with your account name
+Message = namedtuple("Message", ["contact", "timestamp", "author", "text", "chars", "medias", "notes", "has_text", "is_you"],
+                     defaults=("", 0, (), (), True, None))
+
+EPOCH = datetime(1970, 1, 1)
+
+_COLUMNS = ("timestamps", "contact_ids", "author_ids", "chars", "has_text", "is_you", "media_counts", "voice", "text_offsets",
+            "media_offsets")
+
+_local_offsets = {}  # hour since epoch: offset in seconds
+
+
+def local_timestamp(seconds):
+    """Converts a POSIX timestamp in seconds to naive local milliseconds, like datetime.fromtimestamp().
+    The UTC offset is computed once per hour instead of once per message."""
+    hour = seconds // 3600
+    offset = _local_offsets.get(hour)
+    if offset is None:
+        start = calendar.timegm(time.localtime(hour * 3600)) - hour * 3600
+        end = calendar.timegm(time.localtime(hour * 3600 + 3599)) - (hour * 3600 + 3599)
+        if start != end:  # the offset changes during this hour
+            return (seconds + calendar.timegm(time.localtime(seconds)) - seconds) * 1000
+        offset = _local_offsets[hour] = start
+    return (seconds + offset) * 1000
+
+
+def to_timestamp(dt):
+    """Naive datetime to milliseconds since 1970-01-01."""
+    return (dt - EPOCH) // timedelta(milliseconds=1)
+
+
+def to_datetime(timestamp):
+    return EPOCH + timedelta(milliseconds=timestamp)
+
+
+class MessageStore:
+    """Columnar storage of the normalized messages of a package.
+
+    Every column is a typed array indexed by row, contacts and authors are
+    interned into integer ids, texts and media lists are kept in a single UTF-8
+    buffer with an offsets array. Rows are stored in parsing order.
+    """
+
+    def __init__(self):
+        self.contacts = []  # id: name
+        self.authors = []
+        self.__contact_ids = {}
+        self.__author_ids = {}
+
+        self.timestamps = array("q")
+        self.contact_ids = array("i")
+        self.author_ids = array("i")
+        self.chars = array("q")
+        self.has_text = array("b")
+        self.is_you = array("b")  # 1 or 0 from the export, -1 when unknown
+        self.media_counts = array("i")
+        self.voice = array("d")  # seconds
+
+        self.text_offsets = array("q", [0])
+        self.texts = bytearray()
+        self.media_offsets = array("q", [0])
+        self.medias = bytearray()
+
+        self.__notes = defaultdict(list)  # archive path: [(row, member)]
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @staticmethod
+    def __intern(value, ids, names):
+        idx = ids.get(value)
+        if idx is None:
+            idx = ids[value] = len(names)
+            names.append(value)
+        return idx
+
+    def contact_id(self, contact):
+        return self.__contact_ids.get(contact)
+
+    def author_id(self, author):
+        return self.__author_ids.get(author)
+
+    def append(self, message):
+        row = len(self.timestamps)
+        self.timestamps.append(message.timestamp)
+        self.contact_ids.append(self.__intern(message.contact, self.__contact_ids, self.contacts))
+        self.author_ids.append(self.__intern(message.author, self.__author_ids, self.authors))
+        self.chars.append(message.chars)
+        self.has_text.append(message.has_text)
+        self.is_you.append(-1 if message.is_you is None else message.is_you)
+        self.media_counts.append(len(message.medias))
+        self.voice.append(0)
+
+        self.texts += (message.text or "").encode("utf-8")
+        self.text_offsets.append(len(self.texts))
+        if message.medias:
+            self.medias += "\n".join(message.medias).encode("utf-8")
+        self.media_offsets.append(len(self.medias))
+
+        for archive, member in message.notes:
+            self.__notes[str(archive)].append((row, member))
+
+    def extend(self, messages):
+        for message in messages:
+            self.append(message)
+        return self
+
+    def merge(self, other):
+        """Appends the rows of another store (e.g. one parsed by a worker process), remapping its contact and author ids."""
+        if not len(other):
+            return self
+        row, text_base, media_base = len(self), len(self.texts), len(self.medias)
+        contact_map = np.array([self.__intern(name, self.__contact_ids, self.contacts) for name in other.contacts], dtype=np.int32)
+        author_map = np.array([self.__intern(name, self.__author_ids, self.authors) for name in other.authors], dtype=np.int32)
+        self.contact_ids.frombytes(contact_map[np.frombuffer(other.contact_ids, dtype=np.int32)].tobytes())
+        self.author_ids.frombytes(author_map[np.frombuffer(other.author_ids, dtype=np.int32)].tobytes())
+        for name in ("timestamps", "chars", "has_text", "is_you", "media_counts", "voice"):
+            getattr(self, name).extend(getattr(other, name))
+        self.text_offsets.frombytes((np.frombuffer(other.text_offsets, dtype=np.int64)[1:] + text_base).tobytes())
+        self.media_offsets.frombytes((np.frombuffer(other.media_offsets, dtype=np.int64)[1:] + media_base).tobytes())
+        self.texts += other.texts
+        self.medias += other.medias
+        for archive, notes in other.__notes.items():
+            self.__notes[archive].extend((row + note_row, member) for note_row, member in notes)
+        return self
+
+    def resolve_voice(self):
+        """Measures the pending voice notes, one batch per archive."""
+        from src.utils import probe_mp4_durations
+        for archive, notes in self.__notes.items():
+            durations = probe_mp4_durations(archive, [member for _, member in notes])
+            for row, member in notes:
+                self.voice[row] += durations.get(member, 0)
+        self.__notes.clear()
+
+    def text(self, row):
+        return self.texts[self.text_offsets[row]:self.text_offsets[row + 1]].decode("utf-8")
+
+    def media_list(self, row):
+        if not self.media_counts[row]:
+            return []
+        return self.medias[self.media_offsets[row]:self.media_offsets[row + 1]].decode("utf-8").split("\n")
+
+    def message(self, row):
+        return Message(self.contacts[self.contact_ids[row]], self.timestamps[row], self.authors[self.author_ids[row]],
+                       self.text(row), self.chars[row], tuple(self.media_list(row)), (), bool(self.has_text[row]),
+                       None if self.is_you[row] < 0 else bool(self.is_you[row]))
+
+    def sent_by_you(self, pseudo):
+        """Boolean array of the rows you sent: the flag of the export when it has one, otherwise author == pseudo."""
+        self_id = self.author_id(pseudo)
+        by_author = np.frombuffer(self.author_ids, dtype=np.int32) == (-1 if self_id is None else self_id)
+        flags = np.frombuffer(self.is_you, dtype=np.int8)
+        return np.where(flags < 0, by_author, flags == 1)
+
+    def save(self, path):
+        """Writes the store as an uncompressed .npz file (raw column buffers + a JSON header)."""
+        notes = [(archive, row, member) for archive, items in self.__notes.items() for row, member in items]
+        header = {"contacts": self.contacts, "authors": self.authors, "notes": notes}
+        columns = {name: np.frombuffer(getattr(self, name), dtype=getattr(self, name).typecode) for name in _COLUMNS}
+        with open(path, "wb") as f:
+            np.savez(f, header=np.frombuffer(json.dumps(header).encode("utf-8"), dtype=np.uint8),
+                     texts=np.frombuffer(bytes(self.texts), dtype=np.uint8),
+                     medias=np.frombuffer(bytes(self.medias), dtype=np.uint8), **columns)
+
+    @classmethod
+    def load(cls, path):
+        store = cls()
+        with np.load(path) as data:
+            header = json.loads(data["header"].tobytes().decode("utf-8"))
+            for name in _COLUMNS:
+                column = array(getattr(store, name).typecode)
+                column.frombytes(data[name].tobytes())
+                setattr(store, name, column)
+            store.texts = bytearray(data["texts"].tobytes())
+            store.medias = bytearray(data["medias"].tobytes())
+        store.contacts = header["contacts"]
+        store.authors = header["authors"]
+        store.__contact_ids = {name: i for i, name in enumerate(store.contacts)}
+        store.__author_ids = {name: i for i, name in enumerate(store.authors)}
+        for archive, row, member in header["notes"]:
+            store.__notes[archive].append((row, member))
+        return store
+
+    def conversations(self):
+        """Yields (contact, [rows]) in order of first appearance."""
+        rows = defaultdict(list)
+        for row, contact_id in enumerate(self.contact_ids):
+            rows[contact_id].append(row)
+        for contact_id in sorted(rows):
+            yield self.contacts[contact_id], rows[contact_id]
@@ -0,0 +1,308 @@
+import os
+import re
+from array import array
+from datetime import datetime
+
+import numpy as np
+
+from src.utils import ask, ask_date
+from src.conversations import read_conversation
+from src.messagestore import to_datetime
+
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+except ImportError:
+    import sre_parse
+
+_DOTLESS_I = str.maketrans({"ı": "i", "\u0307": None})
+
+
+def fold(text):
+    """Case folding at least as loose as re.IGNORECASE: casefold() also keeps ı and İ apart from i, re doesn't."""
+    return text.casefold().translate(_DOTLESS_I)
+
+
+_REPEATS = tuple(getattr(sre_parse, name) for name in ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT") if hasattr(sre_parse, name))
+
+
+def __required(items):
+    """Query tree of the literals every match of the parsed pattern `items` contains:
+    a string, ("and", [queries]), ("or", [queries]) or None when nothing is required."""
+    parts, literal = [], []
+
+    def flush():
+        if literal:
+            parts.append("".join(literal))
+            literal.clear()
+
+    for op, av in items:
+        if op is sre_parse.LITERAL:
+            literal.append(chr(av))
+            continue
+        flush()
+        sub = None
+        if op is sre_parse.SUBPATTERN:
+            sub = __required(av[-1])
+        elif op is getattr(sre_parse, "ATOMIC_GROUP", None):
+            sub = __required(av)
+        elif op is sre_parse.BRANCH:
+            branches = [__required(branch) for branch in av[1]]
+            if all(branch is not None for branch in branches):
+                sub = ("or", branches)
+        elif op in _REPEATS:
+            min_count, _, item = av
+            if min_count >= 1:
+                sub = __required(item)
+        if sub is not None:
+            parts.append(sub)
+    flush()
+
+    parts = [part for part in parts if not isinstance(part, str) or len(fold(part).encode("utf-8")) >= 3]
+    if not parts:
+        return None
+    return parts[0] if len(parts) == 1 else ("and", parts)
+
+
+def required_literals(pattern):
+    """Literals that must appear in every match of `pattern`, as a query for TrigramIndex.select (None = no constraint)."""
+    try:
+        return __required(sre_parse.parse(pattern))
+    except Exception:
+        return None
+
+
+def _trigrams(data):
+    """24 bit keys of the byte trigrams of a uint8 array."""
+    data = data.astype(np.uint32)
+    return (data[:-2] << 16) | (data[1:-1] << 8) | data[2:]
+
+
+class TrigramIndex:
+    """Trigram index of the messages of an export folder.
+
+    Every message is a document identified by (file, position in the file). The
+    postings of a trigram (3 bytes of the folded UTF-8 text) are the sorted
+    ids of the documents containing it. A search only runs the regex on the
+    documents that contain every trigram of the literals the pattern requires.
+    Files modified after the index was built are searched in full. The
+    timestamp of the first message of every file is kept too, it tells the
+    search which files can still hold earlier hits.
+    """
+
+    FILENAME = ".trigrams.npz"
+    VERSION = 3  # indexes of another version are ignored
+    NO_TIMESTAMP = np.iinfo(np.int64).min
+    CHUNK_SIZE = 1 << 24  # bytes of text processed at once while building
+
+    def __init__(self):
+        self.files = []
+        self.__file_ids = {}
+        self.doc_files = array("i")
+        self.doc_entries = array("i")
+        self.__buffer = bytearray()
+        self.__starts = array("q")  # offset of each buffered document
+        self.__first_doc = 0
+        self.__pairs = []
+        self.stats = {}  # filename: (size, mtime_ns)
+        self.starts = {}  # filename: timestamp of its first message
+        self.keys = self.offsets = self.docs = None
+
+    def add(self, filename, entry, text, timestamp=None):
+        file_id = self.__file_ids.get(filename)
+        if file_id is None:
+            file_id = self.__file_ids[filename] = len(self.files)
+            self.files.append(filename)
+        if timestamp is not None and timestamp < self.starts.get(filename, timestamp + 1):
+            self.starts[filename] = timestamp
+        self.doc_files.append(file_id)
+        self.doc_entries.append(entry)
+        self.__starts.append(len(self.__buffer))
+        self.__buffer += fold(text or "").encode("utf-8")
+        if len(self.__buffer) >= self.CHUNK_SIZE:
+            self.__flush()
+
+    def __flush(self):
+        if not self.__starts:
+            return
+        data = np.frombuffer(bytes(self.__buffer), dtype=np.uint8)
+        starts = np.frombuffer(self.__starts, dtype=np.int64)
+        lengths = np.diff(np.append(starts, len(data)))
+        doc_of = np.repeat(np.arange(self.__first_doc, self.__first_doc + len(starts), dtype=np.uint64), lengths)
+        if len(data) >= 3:
+            same_doc = doc_of[:-2] == doc_of[2:]
+            self.__pairs.append(np.unique((_trigrams(data)[same_doc].astype(np.uint64) << np.uint64(32)) | doc_of[:-2][same_doc]))
+        self.__first_doc += len(starts)
+        self.__buffer = bytearray()
+        self.__starts = array("q")
+
+    def save(self, folder):
+        """Finishes the index and writes it in `folder`, with the size and mtime of the indexed files."""
+        self.__flush()
+        pairs = np.sort(np.concatenate(self.__pairs)) if self.__pairs else np.zeros(0, dtype=np.uint64)
+        self.__pairs = []
+        trigrams = (pairs >> np.uint64(32)).astype(np.uint32)
+        self.docs = (pairs & np.uint64(0xFFFFFFFF)).astype(np.uint32)
+        self.keys, starts = np.unique(trigrams, return_index=True)
+        self.offsets = np.append(starts, len(trigrams)).astype(np.int64)
+        for filename in self.files:
+            stat = os.stat(os.path.join(folder, filename))
+            self.stats[filename] = (stat.st_size, stat.st_mtime_ns)
+        tmp_path = os.path.join(folder, f"{self.FILENAME}.tmp")
+        with open(tmp_path, "wb") as f:
+            np.savez(f, version=self.VERSION, files=np.asarray(self.files, dtype=str),
+                     stats=np.asarray([self.stats[filename] for filename in self.files], dtype=np.int64).reshape(-1, 2),
+                     starts=np.asarray([self.starts.get(filename, self.NO_TIMESTAMP) for filename in self.files], dtype=np.int64),
+                     doc_files=np.frombuffer(self.doc_files, dtype=np.int32),
+                     doc_entries=np.frombuffer(self.doc_entries, dtype=np.int32),
+                     keys=self.keys, offsets=self.offsets, docs=self.docs)
+        os.replace(tmp_path, os.path.join(folder, self.FILENAME))
+
+    @classmethod
+    def load(cls, folder):
+        """Returns the index of `folder`, or None if there is none or it can't be read."""
+        path = os.path.join(folder, cls.FILENAME)
+        if not os.path.exists(path):
+            return None
+        index = cls()
+        try:
+            with np.load(path) as data:
+                if "version" not in data or int(data["version"]) != cls.VERSION:
+                    return None
+                index.files = data["files"].tolist()
+                index.stats = {filename: tuple(stat) for filename, stat in zip(index.files, data["stats"].tolist())}
+                index.starts = {filename: start for filename, start in zip(index.files, data["starts"].tolist())
+                                if start != cls.NO_TIMESTAMP}
+                index.doc_files = data["doc_files"]
+                index.doc_entries = data["doc_entries"]
+                index.keys, index.offsets, index.docs = data["keys"], data["offsets"], data["docs"]
+        except Exception as e:
+            print(f"Can't read the search index: {e}")
+            return None
+        return index
+
+    def is_fresh(self, folder, filename):
+        """True if `filename` was indexed and did not change since."""
+        if filename not in self.stats:
+            return False
+        try:
+            stat = os.stat(os.path.join(folder, filename))
+        except OSError:
+            return False
+        return self.stats[filename] == (stat.st_size, stat.st_mtime_ns)
+
+    def first_datetime(self, folder, filename):
+        """Datetime of the first message of `filename`, None if it is unknown or the file changed since."""
+        if filename not in self.starts or not self.is_fresh(folder, filename):
+            return None
+        return to_datetime(self.starts[filename])
+
+    def __postings(self, trigram):
+        i = np.searchsorted(self.keys, trigram)
+        if i < len(self.keys) and self.keys[i] == trigram:
+            return self.docs[self.offsets[i]:self.offsets[i + 1]]
+        return self.docs[:0]
+
+    def __candidates(self, query):
+        """Sorted ids of the documents that can match `query`, None for all documents."""
+        if query is None:
+            return None
+        if isinstance(query, str):
+            data = np.frombuffer(fold(query).encode("utf-8"), dtype=np.uint8)
+            if len(data) < 3:
+                return None
+            result = None
+            for trigram in np.unique(_trigrams(data)).tolist():
+                postings = self.__postings(trigram)
+                result = postings if result is None else np.intersect1d(result, postings, assume_unique=True)
+                if not len(result):
+                    break
+            return result
+        kind, children = query
+        results = [self.__candidates(child) for child in children]
+        if kind == "or":
+            if any(result is None for result in results):
+                return None
+            return np.unique(np.concatenate(results))
+        result = None
+        for candidates in results:
+            if candidates is not None:
+                result = candidates if result is None else np.intersect1d(result, candidates, assume_unique=True)
+        return result
+
+    def select(self, query):
+        """{filename: set of message positions} of the indexed messages that can match `query`, None for all of them."""
+        docs = self.__candidates(query)
+        if docs is None:
+            return None
+        selection = {filename: set() for filename in self.files}
+        for file_id, entry in zip(np.asarray(self.doc_files)[docs].tolist(), np.asarray(self.doc_entries)[docs].tolist()):
+            selection[self.files[file_id]].add(entry)
+        return selection
+
+
+class MessageFilter:
+    """Cheap predicates checked before the regex runs.
+
+    Authors and contacts are compared casefolded, the datetime range is
+    inclusive. None means no constraint.
+    """
+
+    def __init__(self, authors=None, contacts=None, start=None, end=None):
+        self.authors = self.__names(authors)
+        self.contacts = self.__names(contacts)
+        self.start = start
+        self.end = end
+
+    @staticmethod
+    def __names(names):
+        names = {name.strip().casefold() for name in names or () if name.strip()}
+        return names or None
+
+    def accepts_contact(self, contact):
+        return self.contacts is None or contact.casefold() in self.contacts
+
+    def accepts_author(self, author):
+        return self.authors is None or (author or "").casefold() in self.authors
+
+    def in_range(self, dt):
+        return (self.start is None or dt >= self.start) and (self.end is None or dt <= self.end)
+
+    @property
+    def has_range(self):
+        return self.start is not None or self.end is not None
+
+
+def ask_filters():
+    """Asks the optional filters of a search (empty answers = no filter)."""
+    if ask("Do you want to filter the messages before the regex runs?", ["No", "Yes (authors, contacts, dates)"]) == "No":
+        return MessageFilter()
+    authors = input("Authors, separated by commas (empty for all): ").split(",")
+    contacts = input("Contacts, separated by commas (empty for all): ").split(",")
+    start = ask_date("From (YYYY-MM-DD [HH:MM], empty for no limit): ")
+    end = ask_date("To (YYYY-MM-DD [HH:MM], empty for no limit): ", end=True)
+    return MessageFilter(authors, contacts, start, end)
+
+
+def search_file(folder, filename, pattern, filters, candidates=None):
+    """Worker of search_process: [(datetime, author, filename, message)] of the hits of an exported file, sorted by datetime.
+    Only the message positions of `candidates` are checked when given. Malformed messages are skipped."""
+    regex = re.compile(pattern, re.IGNORECASE)
+    hits = []
+    try:
+        for i, entry in enumerate(read_conversation(os.path.join(folder, filename))):
+            if candidates is not None and i not in candidates:
+                continue
+            try:
+                message = entry.get("message", "")
+                if not message or not filters.accepts_author(entry.get("author")):
+                    continue
+                dt = datetime.fromisoformat(entry.get("datetime"))
+                if filters.in_range(dt) and regex.search(message):
+                    hits.append((dt, entry.get("author"), filename, message))
+            except (AttributeError, TypeError, ValueError):
+                continue
+    except (ValueError, OSError, EOFError) as e:
+        print(f"Can't read {filename}: {e}")
+        return []
+    hits.sort(key=lambda hit: hit[0])
+    return hits
@@ -10,5 +10,38 @@ except ImportError:
 def _as_bool(name: str, default: bool = False) -> bool:
     return os.getenv(name, str(default)).strip().lower() in {"1", "true", "yes", "on"}
 
+def _as_int(name: str, default: int = 0) -> int:
+    try:
+        return int(os.getenv(name, str(default)).strip())
+    except ValueError:
+        return default
+
+def _as_float(name: str, default: float = 0.0) -> float:
+    try:
+        return float(os.getenv(name, str(default)).strip())
+    except ValueError:
+        return default
+
 SKIP_AUDIO_PROCESS = _as_bool("SKIP_AUDIO_PROCESS", False)
-SKIP_CALL_PROCESS = _as_bool("SKIP_CALL_PROCESS", False)
\ No newline at end of file
+SKIP_CALL_PROCESS = _as_bool("SKIP_CALL_PROCESS", False)
+
+CACHE_FOLDER = os.getenv("CACHE_FOLDER", "Cache")
+DURATION_CACHE = _as_bool("DURATION_CACHE", True)
+DURATION_CACHE_MAX_ENTRIES = _as_int("DURATION_CACHE_MAX_ENTRIES", 500000)
+PARSE_CACHE = _as_bool("PARSE_CACHE", True)
+
+PARSE_WORKERS = _as_int("PARSE_WORKERS", 0)  # processes used to parse conversation files, 0 = one per core, 1 = sequential
+EXCEL_WRITE_ONLY = _as_bool("EXCEL_WRITE_ONLY", True)  # stream the workbooks to disk instead of building them in memory
+STATS_BACKEND = os.getenv("STATS_BACKEND", "excel")  # comma separated list of: excel, csv, jsonl, npz
+MERGE_WORKERS = _as_int("MERGE_WORKERS", 0)  # packages processed at the same time by Merge, 0 = one per core, 1 = sequential
+SEARCH_WORKERS = _as_int("SEARCH_WORKERS", 0)  # processes used to search exported conversations, 0 = one per core, 1 = sequential
+
+EXPORT_FORMAT = os.getenv("EXPORT_FORMAT", "json").strip().lower()  # json (indented), jsonl, jsonl.gz or jsonl.xz
+EXPORT_WORKERS = max(1, _as_int("EXPORT_WORKERS", 4))  # threads writing the exported conversations
+
+MEDIA_WORKERS = _as_int("MEDIA_WORKERS", 0)  # threads of each stage of the media export, 0 = one per core
+
+MAP_MODE = os.getenv("MAP_MODE", "clustered").strip().lower()  # clustered (one cluster layer, simplified line) or detailed (one marker per point)
+MAP_SIMPLIFY_TOLERANCE = _as_float("MAP_SIMPLIFY_TOLERANCE", 25.0)  # metres a point can be away from the simplified line, 0 = no simplification
+
+WAREHOUSE_PATH = os.getenv("WAREHOUSE_PATH", "warehouse.sqlite")
\ No newline at end of file
@@ -1,9 +1,21 @@
 import re
 import json
+import heapq
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from tqdm import tqdm
 
 from src.utils import *
+from src.stats import compute_stats
+from src.backends import write_stats
+from src.search import TrigramIndex, ask_filters, required_literals, search_file
+from src.settings import SKIP_AUDIO_PROCESS, SEARCH_WORKERS, EXPORT_FORMAT, EXPORT_WORKERS
+from src.cache import load_parsed, save_parsed
+from src.conversations import FORMATS, conversation_name, write_conversation
+from src.messagestore import Message, MessageStore, local_timestamp, to_timestamp, to_datetime
 
 class SocialNetwork:
+    stats_options = {}  # keyword arguments of compute_stats for this network
+
     @property
     def export_JSON_folder(self):
         path = os.path.join("JSON_Chats", self.__class__.__name__)
@@ -20,6 +32,7 @@ class SocialNetwork:
 
     def __init__(self, path):
         self.path = path
+        self.pseudo = None  # account name, once resolved
 
     def __str__(self):
         path = self.path.relative_to(f"social_exports/{self.__class__.__name__}")
@@ -28,50 +41,146 @@ class SocialNetwork:
     def start_process(self):
         return NotImplemented
 
-    def messages_stats(self, min_messages):
+    def iter_messages(self):
+        """Yields every message of the package as a normalized Message."""
         return NotImplemented
 
+    def account_name(self, store):
+        """Name used as author of your own messages."""
+        return NotImplemented
+
+    def prepare_stats(self):
+        """Asks now what messages_stats would ask the user, so the statistics can then run in another process."""
+        pass
+
+    def parse_messages(self):
+        """Builds the MessageStore of the package, networks with independent conversation files can parse them in parallel."""
+        return MessageStore().extend(self.iter_messages())
+
+    def load_messages(self, voice=True):
+        """Parses the package into a MessageStore, or reloads it from the parse cache if the zip did not change."""
+        paths = self.path if isinstance(self.path, list) else [self.path]
+        store = load_parsed(self.__class__.__name__, paths)
+        if store is None:
+            store = self.parse_messages()
+            save_parsed(self.__class__.__name__, paths, store)
+        if voice and not SKIP_AUDIO_PROCESS:
+            store.resolve_voice()
+        return store
+
+    def messages_stats(self, min_messages):
+        try:
+            store = self.load_messages()
+            pseudo = self.pseudo or self.account_name(store)
+            per_contact_stats, messages_per_day, hour_distribution = compute_stats(store, pseudo, min_messages, **self.stats_options)
+            return per_contact_stats, messages_per_day, hour_distribution, f"{self.__class__.__name__}_{pseudo}"
+        except Exception as e:
+            print(e)
+            return {}, {}, [], f"{self.__class__.__name__}_unknown"
+
     def messages_process(self):
         min_messages = ask_number("Minimum number of messages per contact (0 for no limit set)?")
         per_contact_stats, messages_per_day, hour_distribution, excel_name = self.messages_stats(min_messages)
-        generate_excel(per_contact_stats, messages_per_day, hour_distribution, excel_name)
+        write_stats(per_contact_stats, messages_per_day, hour_distribution, excel_name)
+
+    @staticmethod
+    def __conversation(store, rows):
+        for row in rows:
+            yield {
+                "datetime": str(to_datetime(store.timestamps[row])),
+                "author": store.authors[store.author_ids[row]],
+                "message": store.text(row),
+                "medias": store.media_list(row)
+            }
 
     def export_process(self):
-        return NotImplemented
+        try:
+            if EXPORT_FORMAT not in FORMATS:
+                raise ValueError(f"Unknown export format \"{EXPORT_FORMAT}\", expected one of {', '.join(FORMATS)}")
+            store = self.load_messages(voice=False)
+            export_folder = self.export_JSON_folder
+            index = TrigramIndex()
+            # Conversations are serialized, compressed and written by a bounded pool of threads
+            with ThreadPoolExecutor(max_workers=EXPORT_WORKERS) as pool:
+                pending = set()
+                for contact, rows in tqdm(list(store.conversations())):
+                    contact = re.sub(r'[\\/:*?"<>|]', "_", contact).rstrip(" .")    # remove bad char of filename
+                    filename = f"{contact}.{EXPORT_FORMAT}"
+                    for fmt in FORMATS:  # an export in another format would be searched twice
+                        if fmt != EXPORT_FORMAT and os.path.exists(f"{export_folder}/{contact}.{fmt}"):
+                            os.remove(f"{export_folder}/{contact}.{fmt}")
+                    for i, row in enumerate(rows):
+                        index.add(filename, i, store.text(row), store.timestamps[row])
+                    if len(pending) >= EXPORT_WORKERS * 2:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            future.result()
+                    pending.add(pool.submit(write_conversation, f"{export_folder}/{filename}", self.__conversation(store, rows)))
+                for future in pending:
+                    future.result()
+            index.save(export_folder)
+            print(f"All chats exported to {os.path.join(os.getcwd(), export_folder)}")
+        except Exception as e:
+            print(e)
 
-    def search_process(self):
-        json_files = [f for f in os.listdir(self.export_JSON_folder) if f.endswith(".json")]
-        if not json_files:
-            self.export_process()
+    def search_archive(self, regex, filters):
+        """Runs the regex on the messages as the parser reads them from the package, without exporting anything."""
+        nb = 0
+        for message in self.iter_messages():
+            if not message.text or not filters.accepts_contact(message.contact) or not filters.accepts_author(message.author):
+                continue
+            if filters.has_range and not filters.in_range(to_datetime(message.timestamp)):
+                continue
+            if regex.search(message.text):
+                tqdm.write(f"[{to_datetime(message.timestamp)}] {message.author} ({message.contact}): {message.text}")
+                nb += 1
+        print(f"{nb} results found")
 
+    def search_process(self):
+        export_folder = self.export_JSON_folder
+        json_files = sorted(f for f in os.listdir(export_folder) if conversation_name(f) is not None)
         pattern = str(input("Please give the regex: "))
         regex = re.compile(pattern, re.IGNORECASE)
-        results = []
+        filters = ask_filters()
+        if not json_files:
+            # Nothing exported yet: stream the package instead of exporting it first
+            self.search_archive(regex, filters)
+            return
 
-        for filename in os.listdir(self.export_JSON_folder):
-            if not str(filename).endswith(".json"):
-                continue
+        # Only the messages containing the literals required by the pattern are checked in indexed files
+        index = TrigramIndex.load(export_folder)
+        selection = index.select(required_literals(pattern)) if index is not None else None
 
-            filepath = os.path.join(self.export_JSON_folder, filename)
-            try:
-                with open(filepath, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-            except (json.JSONDecodeError, OSError) as e:
-                print(f"Can't read {filename}: {e}")
+        jobs, starts = [], []
+        for filename in json_files:
+            if not filters.accepts_contact(conversation_name(filename)):
                 continue
-
-            for entry in data:
-                message = entry.get("message", "")
-                if message == "" or not message:
+            candidates = None
+            if selection is not None and index.is_fresh(export_folder, filename):
+                candidates = selection[filename]
+                if not candidates:
                     continue
-                if regex.search(message):
-                    results.append({
-                        "file": filename,
-                        "datetime": entry.get("datetime"),
-                        "author": entry.get("author"),
-                        "message": message
-                    })
-
-        for m in results:
-            print(f"[{m['datetime']}] {m['author']} ({m['file']}): {m['message']}")
-        print(f"{len(results)} results found")
\ No newline at end of file
+            jobs.append((export_folder, filename, pattern, filters, candidates))
+            start = index.first_datetime(export_folder, filename) if index is not None else None
+            starts.append(datetime.min if start is None else start)
+
+        # Every file comes back sorted by datetime. Its hits join a heap, and a hit is printed as soon as
+        # no file still searched starts before it, so results stream out in datetime order. The files
+        # that start first are submitted first, ties are printed in the order of the file names.
+        order = sorted(range(len(jobs)), key=lambda job: starts[job])
+        unfinished = [(starts[job], job) for job in order]  # already a heap, finished files are removed lazily
+        finished = set()
+        hits = []
+        nb = 0
+        for position, file_hits in parallel_unordered(search_file, [jobs[job] for job in order], SEARCH_WORKERS):
+            job = order[position]
+            finished.add(job)
+            for rank, hit in enumerate(file_hits):
+                heapq.heappush(hits, (hit[0], job, rank, hit))
+            while unfinished and unfinished[0][1] in finished:
+                heapq.heappop(unfinished)
+            while hits and (not unfinished or hits[0][0] < unfinished[0][0]):
+                dt, _, _, (_, author, filename, message) = heapq.heappop(hits)
+                tqdm.write(f"[{dt}] {author} ({filename}): {message}")
+                nb += 1
+        print(f"{nb} results found")
\ No newline at end of file
@@ -0,0 +1,158 @@
+import numpy as np
+from collections import defaultdict
+from datetime import date, timedelta
+
+from src.messagestore import EPOCH
+
+DAY_MS = 86400000
+HOUR_MS = 3600000
+EPOCH_ORDINAL = EPOCH.toordinal()  # date ordinal of the day 0 of the timestamps
+
+
+def compute_stats(store, pseudo, min_messages=0, voice=True, delays=True, count_text_only=False):
+    """Computes (per_contact_stats, messages_per_day, hour_distribution) from a MessageStore.
+
+    A message is yours when the export flags it as sent by you, or else when
+    its author is `pseudo`. Contacts with less than
+    `min_messages` messages are left out of every output. `voice` and `delays`
+    add the voice message time and answer delay columns, `count_text_only` only
+    counts messages with a text part in the "Messages" columns.
+
+    Everything is computed on the store columns with NumPy: bincount for the
+    per contact, per hour and per day counters, and a diff over consecutive
+    messages of the same contact for answer delays. messages_per_day is keyed
+    by date ordinal (date.toordinal()), see Timeline for the rollups.
+    """
+    nb_contacts = len(store.contacts)
+
+    contact_ids = np.frombuffer(store.contact_ids, dtype=np.int32).astype(np.int64)
+    counts = np.bincount(contact_ids, minlength=nb_contacts)
+    kept = counts >= min_messages if min_messages > 0 else np.ones(nb_contacts, dtype=bool)
+    mask = kept[contact_ids]
+
+    contact_ids = contact_ids[mask]
+    timestamps = np.frombuffer(store.timestamps, dtype=np.int64)[mask]
+    is_you = store.sent_by_you(pseudo)[mask]
+    chars = np.frombuffer(store.chars, dtype=np.int64)[mask]
+    durations = np.frombuffer(store.voice, dtype=np.float64)[mask]
+    counted = np.frombuffer(store.has_text, dtype=np.int8)[mask].astype(bool) if count_text_only else np.ones(len(contact_ids), dtype=bool)
+
+    # Hour distribution
+    hour_distribution = np.bincount(timestamps[is_you] // HOUR_MS % 24, minlength=24).tolist()
+
+    # Messages per day
+    days = timestamps // DAY_MS
+    day_contact, inverse = np.unique(days * max(nb_contacts, 1) + contact_ids, return_inverse=True)
+    nb_all = np.bincount(inverse, minlength=len(day_contact))
+    nb_you = np.bincount(inverse, weights=is_you, minlength=len(day_contact)).astype(np.int64)
+    messages_per_day = {}  # date ordinal: { name: (nb_you, nb_oth), name : (nb_you, nb_oth) }
+    for key, you, total in zip(day_contact.tolist(), nb_you.tolist(), nb_all.tolist()):
+        day, contact_id = divmod(key, max(nb_contacts, 1))
+        messages_per_day.setdefault(day + EPOCH_ORDINAL, {})[store.contacts[contact_id]] = (you, total - you)
+
+    # Number of messages and char by contact
+    def per_contact(weights):
+        return np.bincount(contact_ids, weights=weights, minlength=nb_contacts)
+
+    you_counted = is_you & counted
+    oth_counted = ~is_you & counted
+    msg_you = per_contact(you_counted).astype(np.int64)
+    msg_oth = per_contact(oth_counted).astype(np.int64)
+    char_you = per_contact(chars * you_counted).astype(np.int64)
+    char_oth = per_contact(chars * oth_counted).astype(np.int64)
+
+    # Voice message time
+    voice_you = per_contact(durations * is_you)
+    voice_oth = per_contact(durations * ~is_you)
+
+    # Message delay: consecutive messages of the same contact whose sender changed
+    order = np.argsort(contact_ids, kind="stable")
+    sorted_contacts, sorted_you, sorted_timestamps = contact_ids[order], is_you[order], timestamps[order]
+    answer = (sorted_contacts[1:] == sorted_contacts[:-1]) & (sorted_you[1:] != sorted_you[:-1])
+    gaps = np.abs(np.diff(sorted_timestamps))
+    answer_you = answer & sorted_you[1:]
+    answer_oth = answer & ~sorted_you[1:]
+    next_contacts = sorted_contacts[1:]
+    delay_you = np.bincount(next_contacts[answer_you], weights=gaps[answer_you], minlength=nb_contacts)
+    delay_oth = np.bincount(next_contacts[answer_oth], weights=gaps[answer_oth], minlength=nb_contacts)
+    nb_delay_you = np.bincount(next_contacts[answer_you], minlength=nb_contacts)
+    nb_delay_oth = np.bincount(next_contacts[answer_oth], minlength=nb_contacts)
+
+    per_contact_stats = defaultdict(list)
+    for contact_id in np.flatnonzero(kept).tolist():
+        per_contact_stats["Contact"].append(store.contacts[contact_id])
+
+        per_contact_stats["Messages"].append(int(msg_you[contact_id] + msg_oth[contact_id]))
+        per_contact_stats["Messages sent by you"].append(int(msg_you[contact_id]))
+        per_contact_stats["Messages sent by your contact"].append(int(msg_oth[contact_id]))
+
+        per_contact_stats["Characters"].append(int(char_you[contact_id] + char_oth[contact_id]))
+        per_contact_stats["Characters sent by you"].append(int(char_you[contact_id]))
+        per_contact_stats["Characters sent by your contact"].append(int(char_oth[contact_id]))
+
+        if voice:
+            per_contact_stats["Voice message time"].append(timedelta(seconds=float(voice_you[contact_id] + voice_oth[contact_id])))
+            per_contact_stats["Your voice message time"].append(timedelta(seconds=float(voice_you[contact_id])))
+            per_contact_stats["Contact voice message time"].append(timedelta(seconds=float(voice_oth[contact_id])))
+
+        if delays:
+            for key, total, count in (("Your answer delay", delay_you[contact_id], nb_delay_you[contact_id]),
+                                      ("Contact answer delay", delay_oth[contact_id], nb_delay_oth[contact_id])):
+                per_contact_stats[key].append(timedelta(milliseconds=float(total / count)) if count else timedelta(0))
+
+    total_msg, total_chr = len(contact_ids), int(chars[counted].sum())
+    print(f"\nLoaded {total_msg} messages in total with {total_chr} characters")
+    return per_contact_stats, messages_per_day, hour_distribution
+
+
+class Timeline:
+    """Daily, weekly, monthly, yearly and cumulative message counts of a messages_per_day dict.
+
+    The totals of every period are bucketed in a single pass with integer date
+    ordinals, labels are only formatted once per bucket. The per contact rows of
+    the day sheets are produced lazily, one day at a time.
+    """
+
+    def __init__(self, messages_per_day):
+        self.messages_per_day = messages_per_day
+        self.days = sorted(messages_per_day)
+        self.contacts = sorted({contact for daily in messages_per_day.values() for contact in daily})
+        self.weekly, self.monthly, self.yearly = {}, {}, {}  # (year, week) / (year, month) / year: nb messages
+        year, year_start = None, None
+        for ordinal in self.days:
+            total = sum(sum(value) for value in messages_per_day[ordinal].values())
+            day = date.fromordinal(ordinal)
+            if day.year != year:
+                year, year_start = day.year, date(day.year, 1, 1).toordinal()
+            week = (ordinal - year_start + 7 - (ordinal % 7)) // 7  # like %U: weeks start on Sunday (ordinal % 7 == 0)
+            self.weekly[year, week] = self.weekly.get((year, week), 0) + total
+            self.monthly[year, day.month] = self.monthly.get((year, day.month), 0) + total
+            self.yearly[year] = self.yearly.get(year, 0) + total
+
+    def __len__(self):
+        return len(self.days)
+
+    @staticmethod
+    def day_label(ordinal):
+        day = date.fromordinal(ordinal)
+        return f"{day.day:02d}/{day.month:02d}/{day.year:04d}"
+
+    def weeks(self):
+        return [(f"{year:04d}-W{week:02d}", count) for (year, week), count in sorted(self.weekly.items())]
+
+    def months(self):
+        return [(f"{year:04d}-{month:02d}", count) for (year, month), count in sorted(self.monthly.items())]
+
+    def years(self):
+        return [(f"{year:04d}", count) for year, count in sorted(self.yearly.items())]
+
+    def rows(self, cumulative=False):
+        """Yields (date label, [messages per contact], total) for every day, running totals if `cumulative`."""
+        index = {contact: i for i, contact in enumerate(self.contacts)}
+        counts = [0] * len(self.contacts)
+        for ordinal in self.days:
+            if not cumulative:
+                counts = [0] * len(self.contacts)
+            for contact, value in self.messages_per_day[ordinal].items():
+                counts[index[contact]] += sum(value)
+            yield self.day_label(ordinal), counts, sum(counts)
\ No newline at end of file
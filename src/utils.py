@@ -1,10 +1,22 @@
+import io
 import os
+import json
 import sys
 import time
+import zlib
 import struct
-import zipfile
+import hashlib
+import threading
 import importlib
+from collections import deque
 from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from tqdm import tqdm
+
+from src.archive import open_archive
+from src.cache import duration_cache
+from src.stats import Timeline
+from src.settings import PARSE_WORKERS, EXCEL_WRITE_ONLY, MEDIA_WORKERS
 
 _loaded_modules = {}
 
@@ -55,48 +67,165 @@ def ask_number(question):
         except ValueError:
             print("Please enter a valid number.")
 
-def get_mp4_duration(path, file_path):
-    """Directly reads the duration of an MP4 file by parsing the 'mvhd' box."""
+
+def ask_date(question, end=False):
+    """Asks an optional ISO date (None when empty). A day alone given as `end` includes the whole day."""
+    while True:
+        answer = input(question).strip()
+        if not answer:
+            return None
+        try:
+            dt = datetime.fromisoformat(answer)
+        except ValueError:
+            print("Please enter a date like 2021-03-31 or 2021-03-31 18:00.")
+            continue
+        if end and len(answer) <= 10:
+            dt = datetime.combine(dt.date(), datetime.max.time())
+        return dt
+
+def parallel_map(function, arguments, workers=PARSE_WORKERS):
+    """Calls function(*args) for every tuple of `arguments` and yields the results in the order of `arguments`.
+
+    With more than one worker (0 = one per core) the calls run in a process pool,
+    so `function` and its arguments must be picklable. The output order never
+    depends on scheduling, which keeps everything built from it deterministic.
+    """
+    arguments = list(arguments)
+    workers = min(workers or os.cpu_count() or 1, len(arguments))
+    if workers <= 1:
+        for args in tqdm(arguments):
+            yield function(*args)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        chunk_size = max(1, len(arguments) // (workers * 8))
+        yield from tqdm(pool.map(function, *zip(*arguments), chunksize=chunk_size), total=len(arguments))
+
+
+def parallel_unordered(function, arguments, workers=PARSE_WORKERS):
+    """Same as parallel_map but yields (position in `arguments`, result) as soon as each call finishes.
+    Calls are submitted in the order of `arguments`."""
+    arguments = list(arguments)
+    workers = min(workers or os.cpu_count() or 1, len(arguments))
+    if workers <= 1:
+        for i, args in enumerate(tqdm(arguments)):
+            yield i, function(*args)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool, tqdm(total=len(arguments)) as progress:
+        futures = {pool.submit(function, *args): i for i, args in enumerate(arguments)}
+        for future in as_completed(futures):
+            progress.update()
+            yield futures[future], future.result()
+
+
+def __read_box_header(f):
+    header = f.read(8)
+    if len(header) < 8:
+        return None, None, 0
+    size, kind = struct.unpack(">I4s", header)
+    header_size = 8
+    if size == 1:  # 64-bit largesize follows the type
+        size = struct.unpack(">Q", f.read(8))[0]
+        header_size = 16
+    return kind, size, header_size
+
+def __read_mvhd(f, file_path):
+    """Walks the top-level atoms up to 'moov/mvhd' and returns the duration in seconds.
+    Only box headers and the first bytes of 'mvhd' are read, everything else is skipped with seek()."""
+    while True:
+        kind, size, header_size = __read_box_header(f)
+        if kind is None:
+            print(f"Error: 'mvhd' not found in {file_path}")
+            return 0
+        if kind == b"moov":
+            end = f.tell() + size - header_size if size else None
+            while end is None or f.tell() < end:
+                child, child_size, child_header = __read_box_header(f)
+                if child is None:
+                    break
+                if child == b"mvhd":
+                    data = f.read(32)
+                    version = data[0]
+                    if version == 0:
+                        time_scale, duration = struct.unpack(">II", data[12:20])
+                    elif version == 1:
+                        time_scale, duration = struct.unpack(">IQ", data[20:32])
+                    else:
+                        print(f"Error: Unknown version of mvhd for {file_path}")
+                        return 0
+                    return duration / time_scale if time_scale > 0 else 0
+                if child_size == 0:
+                    break
+                f.seek(child_size - child_header, 1)
+            print(f"Error: 'mvhd' not found in {file_path}")
+            return 0
+        if size == 0:  # last box, extends to the end of the file
+            print(f"Error: 'mvhd' not found in {file_path}")
+            return 0
+        f.seek(size - header_size, 1)
+
+def probe_mp4_durations(path, file_paths):
+    """Reads the duration of a batch of MP4 members of the same archive.
+    Members are visited in archive order so the zip is read front to back, and each one
+    only costs a few atom headers. Returns {file_path: seconds}, 0 for unreadable members.
+    Durations already in the duration cache (same member, CRC and size) are not probed again."""
     try:
-        with zipfile.ZipFile(path, mode="r") as package:
-            with package.open(file_path, "r") as f:
-                data = f.read()
-                mvhd_pos = data.find(b'mvhd')
-                if mvhd_pos == -1:
-                    print(f"Error: 'mvhd' not found in {file_path}")
-                    return 0
-                mvhd_offset = mvhd_pos + 4
-                version = data[mvhd_offset]
-
-                if version == 0:
-                    time_scale, duration = struct.unpack(">II", data[mvhd_offset + 12: mvhd_offset + 20])
-                elif version == 1:
-                    time_scale, duration = struct.unpack(">IQ", data[mvhd_offset + 20: mvhd_offset + 32])
-                else:
-                    print(f"Error: Unknown version of mvhd for {file_path}")
-                    return 0
-                return duration / time_scale if time_scale > 0 else 0
+        package = open_archive(path)
     except Exception as e:
-        print(f"Error with {file_path} : {e}")
-        return 0
+        print(f"Error with {path} : {e}")
+        return {file_path: 0 for file_path in file_paths}
+    infos = [package.getinfo(name) for name in set(file_paths) if name in package]
+    cache = duration_cache()
+    durations = cache.get_many(path, infos) if cache else {}
+    probed = []
+    for info in sorted(infos, key=lambda i: i.header_offset):
+        if info.filename in durations:
+            continue
+        try:
+            with package.open(info, "r") as f:
+                durations[info.filename] = __read_mvhd(f, info.filename)
+        except Exception as e:
+            print(f"Error with {info.filename} : {e}")
+            durations[info.filename] = 0
+        probed.append((info, durations[info.filename]))
+    if cache and probed:
+        cache.put_many(path, probed)
+    for file_path in file_paths:
+        if file_path not in package:
+            print(f"Error with {file_path} : not found in {path}")
+            durations[file_path] = 0
+    return durations
+
+def get_mp4_duration(path, file_path):
+    """Directly reads the duration of an MP4 file by parsing the 'mvhd' box."""
+    return probe_mp4_durations(path, [file_path]).get(file_path, 0)
 
 def generate_excel(per_contact_stats, messages_per_day, hour_distribution, excel_name="analysis.xlsx"):
     try:
         from openpyxl import Workbook
+        from openpyxl.cell import WriteOnlyCell
         from openpyxl.utils import get_column_letter
         from openpyxl.chart import BarChart, PieChart, Reference, LineChart
     except ImportError:
         raise RuntimeError("You must install all libraries to use this feature")
 
-    base_name = excel_name if excel_name.endswith(".xlsx") else f"{excel_name}.xlsx"
-    count = 1
-    while os.path.exists(f"Excels/{base_name}"):
-        base_name = f"{excel_name}{count}.xlsx"
-        if not base_name.endswith(".xlsx"):
-            base_name += ".xlsx"
-        count += 1
+    # Every sheet is filled row by row with append(), so in write-only mode rows go
+    # straight to disk. Sheets are created in their final order.
+    wb = Workbook(write_only=EXCEL_WRITE_ONLY)
+    if not EXCEL_WRITE_ONLY:
+        wb.remove(wb.active)
+    charts_ws = wb.create_sheet("Charts")
+    ws1 = wb.create_sheet("Global")
+    ws3 = wb.create_sheet("Cumulative per day")
+    ws_hour = wb.create_sheet("Message Activity by Hour")
+    ws2 = wb.create_sheet("Messages per day")
+    ws_week = wb.create_sheet("Messages per week")
+    ws_month = wb.create_sheet("Messages per month")
+    ws_year = wb.create_sheet("Messages per year")
 
-    wb = Workbook()
+    def formatted(ws, value, number_format):
+        cell = WriteOnlyCell(ws, value=value)
+        cell.number_format = number_format
+        return cell
 
     # sort contact by msg
     sorted_indexes = sorted(
@@ -107,132 +236,51 @@ def generate_excel(per_contact_stats, messages_per_day, hour_distribution, excel
     for key in per_contact_stats:
         per_contact_stats[key] = [per_contact_stats[key][i] for i in sorted_indexes]
 
-    charts_ws = wb.active
-    charts_ws.title = "Charts"
-
     # ===== Global =====
-    ws1 = wb.create_sheet("Global")
-
     keys = list(per_contact_stats.keys())
     length = len(per_contact_stats[keys[0]])
 
-    for col, key in enumerate(keys, 1):
-        ws1.cell(row=1, column=col, value=key)
-
+    ws1.append(keys)
     for row in range(length):
-        for col, key in enumerate(keys, 1):
+        values = []
+        for key in keys:
             val = per_contact_stats[key][row]
-            cell = ws1.cell(row=row + 2, column=col, value=val)
             if isinstance(val, timedelta):
-                cell.value = val.total_seconds() / 86400
-                cell.number_format = '[h]:mm:ss'
+                val = formatted(ws1, val.total_seconds() / 86400, '[h]:mm:ss')
+            values.append(val)
+        ws1.append(values)
 
-    total_row = length + 3
-    ws1.cell(row=total_row, column=1, value="TOTAL")
+    ws1.append([])
+    totals = ["TOTAL"]
     for col, key in enumerate(keys[1:], 2):
         col_letter = get_column_letter(col)
         if "delay" in key.lower() or "voice" in key.lower():
-            cell = ws1.cell(row=total_row, column=col,
-                            value=f"=AVERAGE({col_letter}2:{col_letter}{length + 1})")
-            cell.number_format = '[h]:mm:ss'
+            totals.append(formatted(ws1, f"=AVERAGE({col_letter}2:{col_letter}{length + 1})", '[h]:mm:ss'))
         else:
-            ws1.cell(row=total_row, column=col,
-                     value=f"=SUM({col_letter}2:{col_letter}{length + 1})")
-
-    # ===== Messages per day =====
-    ws2 = wb.create_sheet("Messages per day")
-    all_dates = sorted(set(datetime.strptime(date, "%d/%m/%Y")
-                           for date in messages_per_day.keys()))
-    contacts = sorted({c for daily in messages_per_day.values() for c in daily})
-    ws2.cell(row=1, column=1, value="Date")
-    for col, contact in enumerate(contacts, 2):
-        ws2.cell(row=1, column=col, value=contact)
-    ws2.cell(row=1, column=len(contacts) + 2, value="TOTAL")
-
-    for row, dt in enumerate(all_dates, 2):
-        date_str = dt.strftime("%d/%m/%Y")
-        ws2.cell(row=row, column=1, value=date_str)
-        total = 0
-        for col, contact in enumerate(contacts, 2):
-            msg_count = sum(messages_per_day.get(date_str, {}).get(contact, (0, 0)))
-            ws2.cell(row=row, column=col, value=msg_count)
-            total += msg_count
-        ws2.cell(row=row, column=len(contacts) + 2, value=total)
-
-    # ===== Messages per week =====
-    ws_week = wb.create_sheet("Messages per week")
-    weekly_data = {}
-    for dt in all_dates:
-        week = dt.strftime("%Y-W%U")
-        weekly_data[week] = weekly_data.get(week, 0) + sum(
-            messages_per_day.get(dt.strftime("%d/%m/%Y"), {}).get(c, (0, 0))[0] +
-            messages_per_day.get(dt.strftime("%d/%m/%Y"), {}).get(c, (0, 0))[1]
-            for c in contacts
-        )
-    ws_week.cell(row=1, column=1, value="Week")
-    ws_week.cell(row=1, column=2, value="Messages")
-    for i, (week, count) in enumerate(sorted(weekly_data.items()), start=2):
-        ws_week.cell(row=i, column=1, value=week)
-        ws_week.cell(row=i, column=2, value=count)
-
-    # ===== Messages per month =====
-    ws_month = wb.create_sheet("Messages per month")
-    monthly_data = {}
-    for dt in all_dates:
-        month = dt.strftime("%Y-%m")
-        monthly_data[month] = monthly_data.get(month, 0) + sum(
-            messages_per_day.get(dt.strftime("%d/%m/%Y"), {}).get(c, (0, 0))[0] +
-            messages_per_day.get(dt.strftime("%d/%m/%Y"), {}).get(c, (0, 0))[1]
-            for c in contacts
-        )
-    ws_month.cell(row=1, column=1, value="Month")
-    ws_month.cell(row=1, column=2, value="Messages")
-    for i, (month, count) in enumerate(sorted(monthly_data.items()), start=2):
-        ws_month.cell(row=i, column=1, value=month)
-        ws_month.cell(row=i, column=2, value=count)
-
-    # ===== Messages per year =====
-    ws_year = wb.create_sheet("Messages per year")
-    yearly_data = {}
-    for dt in all_dates:
-        year = dt.strftime("%Y")
-        yearly_data[year] = yearly_data.get(year, 0) + sum(
-            messages_per_day.get(dt.strftime("%d/%m/%Y"), {}).get(c, (0, 0))[0] +
-            messages_per_day.get(dt.strftime("%d/%m/%Y"), {}).get(c, (0, 0))[1]
-            for c in contacts
-        )
-    ws_year.cell(row=1, column=1, value="Year")
-    ws_year.cell(row=1, column=2, value="Messages")
-    for i, (year, count) in enumerate(sorted(yearly_data.items()), start=2):
-        ws_year.cell(row=i, column=1, value=year)
-        ws_year.cell(row=i, column=2, value=count)
-
-    # ===== Cumulative per day =====
-    ws3 = wb.create_sheet("Cumulative per day")
-    ws3.cell(row=1, column=1, value="Date")
-    for col, contact in enumerate(contacts, 2):
-        ws3.cell(row=1, column=col, value=contact)
-    ws3.cell(row=1, column=len(contacts) + 2, value="TOTAL")
-
-    cumulative = [0] * len(contacts)
-    for row, dt in enumerate(all_dates, 2):
-        date_str = dt.strftime("%d/%m/%Y")
-        ws3.cell(row=row, column=1, value=date_str)
-        total = 0
-        for col, contact in enumerate(contacts, 2):
-            msg_count = sum(messages_per_day.get(date_str, {}).get(contact, (0, 0)))
-            cumulative[col - 2] += msg_count
-            ws3.cell(row=row, column=col, value=cumulative[col - 2])
-            total += cumulative[col - 2]
-        ws3.cell(row=row, column=len(contacts) + 2, value=total)
+            totals.append(f"=SUM({col_letter}2:{col_letter}{length + 1})")
+    ws1.append(totals)
+
+    # ===== Messages per day / Cumulative per day =====
+    timeline = Timeline(messages_per_day)
+    contacts = timeline.contacts
+    ws2.append(["Date"] + contacts + ["TOTAL"])
+    for date_str, counts, total in timeline.rows():
+        ws2.append([date_str] + counts + [total])
+    ws3.append(["Date"] + contacts + ["TOTAL"])
+    for date_str, counts, total in timeline.rows(cumulative=True):
+        ws3.append([date_str] + counts + [total])
+
+    # ===== Messages per week / month / year =====
+    weekly_data, monthly_data, yearly_data = timeline.weeks(), timeline.months(), timeline.years()
+    for ws, period, data in ((ws_week, "Week", weekly_data), (ws_month, "Month", monthly_data), (ws_year, "Year", yearly_data)):
+        ws.append([period, "Messages"])
+        for key, msg_count in data:
+            ws.append([key, msg_count])
 
     # ===== Message Activity by Hour =====
-    ws_hour = wb.create_sheet("Message Activity by Hour")
-    ws_hour.cell(row=1, column=1, value="Hour")
-    ws_hour.cell(row=1, column=2, value="Nb msg")
+    ws_hour.append(["Hour", "Nb msg"])
     for i in range(24):
-        ws_hour.cell(row=i + 2, column=1, value=i)
-        ws_hour.cell(row=i + 2, column=2, value=hour_distribution[i])
+        ws_hour.append([i, hour_distribution[i]])
 
 
     def place_chart(chart, pos):
@@ -254,8 +302,8 @@ def generate_excel(per_contact_stats, messages_per_day, hour_distribution, excel
     # Cumulative chart
     cum_chart = LineChart()
     cum_chart.title = "Cumulative Messages per Day"
-    data = Reference(ws3, min_col=2, max_col=len(contacts) + 1, min_row=1, max_row=len(all_dates) + 1)
-    cats = Reference(ws3, min_col=1, min_row=2, max_row=len(all_dates) + 1)
+    data = Reference(ws3, min_col=2, max_col=len(contacts) + 1, min_row=1, max_row=len(timeline) + 1)
+    cats = Reference(ws3, min_col=1, min_row=2, max_row=len(timeline) + 1)
     cum_chart.add_data(data, titles_from_data=True)
     cum_chart.set_categories(cats)
     place_chart(cum_chart, "A1")
@@ -273,14 +321,13 @@ def generate_excel(per_contact_stats, messages_per_day, hour_distribution, excel
             you_delays.append(-per_contact_stats["Your answer delay"][i].total_seconds() / 60)
             contact_delays.append(per_contact_stats["Contact answer delay"][i].total_seconds() / 60)
 
-    for i, name in enumerate(names, start=2):
-        charts_ws.cell(row=i, column=27, value=name)
+    padding = [None] * 26  # the chart data lives in columns AA:AC
+    charts_ws.append(padding + ["Contact", "You", "Contact"])
+    for i, name in enumerate(names):
         if "Your answer delay" in per_contact_stats:
-            charts_ws.cell(row=i, column=28, value=you_delays[i - 2])
-            charts_ws.cell(row=i, column=29, value=contact_delays[i - 2])
-    charts_ws.cell(row=1, column=27, value="Contact")
-    charts_ws.cell(row=1, column=28, value="You")
-    charts_ws.cell(row=1, column=29, value="Contact")
+            charts_ws.append(padding + [name, you_delays[i], contact_delays[i]])
+        else:
+            charts_ws.append(padding + [name])
 
     data = Reference(charts_ws, min_col=28, max_col=29, min_row=1, max_row=1 + len(names))
     cats = Reference(charts_ws, min_col=27, min_row=2, max_row=1 + len(names))
@@ -290,7 +337,7 @@ def generate_excel(per_contact_stats, messages_per_day, hour_distribution, excel
 
     # place bar
     place_chart(make_bar("Message Activity by Hour", "Hour", "Messages", ws_hour, 2, 1, 25), "A25")
-    place_chart(make_bar("Messages per Day", "Date", "Messages", ws2, len(contacts)+2, 1, len(all_dates)+1), "N25")
+    place_chart(make_bar("Messages per Day", "Date", "Messages", ws2, len(contacts)+2, 1, len(timeline)+1), "N25")
     place_chart(make_bar("Messages per Week", "Week", "Messages", ws_week, 2, 1, 1 + len(weekly_data)), "A49")
     place_chart(make_bar("Messages per Month", "Month", "Messages", ws_month, 2, 1, 1 + len(monthly_data)), "N49")
     place_chart(make_bar("Messages per Year", "Year", "Messages", ws_year, 2, 1, 1 + len(yearly_data)), "A73")
@@ -306,88 +353,97 @@ def generate_excel(per_contact_stats, messages_per_day, hour_distribution, excel
     pie_chart.width = 21
     charts_ws.add_chart(pie_chart, "N73")
 
-    # ===== sheets order =====
-    sheet_order = [
-        charts_ws.title,
-        ws1.title,
-        ws3.title,
-        ws_hour.title,
-        ws2.title,
-        ws_week.title,
-        ws_month.title,
-        ws_year.title,
-    ]
-    for i, sheet_name in enumerate(sheet_order):
-        wb.move_sheet(sheet_name, offset=i - wb.sheetnames.index(sheet_name))
-
-    create_directory("Excels")
-    wb.save(f"Excels/{base_name}")
-    print(f"Excels/{base_name} was successfully created")
-
-def __add_jpeg_metadata(path, dt, contact=None, send=None, res=None):
-    piexif = lazy_import("piexif")
-    try:
-        exif_dict = piexif.load(path)
-        date_str = dt.strftime("%Y:%m:%d %H:%M:%S")
-        exif_dict["0th"][piexif.ImageIFD.DateTime] = date_str.encode('utf-8')
-        exif_dict["Exif"][piexif.ExifIFD.DateTimeOriginal] = date_str.encode('utf-8')
-        exif_dict["Exif"][piexif.ExifIFD.DateTimeDigitized] = date_str.encode('utf-8')
-        if contact and send and res:
-            exif_dict["0th"][piexif.ImageIFD.Artist] = send.encode('utf-8')
-            exif_dict["0th"][piexif.ImageIFD.ImageDescription] = f"{send} to {res}".encode('utf-8')
-            exif_dict["0th"][piexif.ImageIFD.XPTitle] = f"Contact: {contact}".encode('utf-16le')
-        elif contact:
-            exif_dict["0th"][piexif.ImageIFD.Artist] = f"Contact: {contact}".encode('utf-8')
-            exif_dict["0th"][piexif.ImageIFD.ImageDescription] = f"Contact: {contact}".encode('utf-8')
-            exif_dict["0th"][piexif.ImageIFD.XPTitle] = f"Contact: {contact}".encode('utf-16le')
-        exif_bytes = piexif.dump(exif_dict)
-        piexif.insert(exif_bytes, path)
-    except Exception as e:
-        print(f"[EXIF ERROR] {path}: {e}")
-
-def __add_png_metadata(path, dt, contact=None, send=None, res=None):
-    PngImagePlugin = lazy_import("PIL.PngImagePlugin")
-    Image = lazy_import("PIL.Image")
-    try:
-        img = Image.open(path)
-        meta = PngImagePlugin.PngInfo()
-        meta.add_text("Creation Time", dt.strftime("%Y-%m-%d %H:%M:%S"))
-        meta.add_text("File Access Date", dt.strftime("%Y-%m-%d %H:%M:%S"))
-        meta.add_text("File Inode Change Date", dt.strftime("%Y-%m-%d %H:%M:%S"))
-        meta.add_text("File Modify Date", dt.strftime("%Y-%m-%d %H:%M:%S"))
-        if send and res:
-            meta.add_text("Author", send)
-            meta.add_text("Title", f"{send} to {res}")
-        elif contact:
-            meta.add_text("Author", f"Contact: {contact}")
-            meta.add_text("Title", f"Contact: {contact}")
-        img.save(path, pnginfo=meta)
-    except Exception as e:
-        print(f"[PNG ERROR] {path}: {e}")
+    path = reserve_output("Excels", excel_name.removesuffix(".xlsx"), [".xlsx"])[0]
+    wb.save(path)
+    print(f"{path} was successfully created")
 
-def __add_mp4_metadata(path, dt, contact=None, send=None, res=None):
+def __jpeg_metadata(data, dt, contact=None, send=None, res=None):
+    piexif = lazy_import("piexif")
+    exif_dict = piexif.load(data)
+    date_str = dt.strftime("%Y:%m:%d %H:%M:%S")
+    exif_dict["0th"][piexif.ImageIFD.DateTime] = date_str.encode('utf-8')
+    exif_dict["Exif"][piexif.ExifIFD.DateTimeOriginal] = date_str.encode('utf-8')
+    exif_dict["Exif"][piexif.ExifIFD.DateTimeDigitized] = date_str.encode('utf-8')
+    if contact and send and res:
+        exif_dict["0th"][piexif.ImageIFD.Artist] = send.encode('utf-8')
+        exif_dict["0th"][piexif.ImageIFD.ImageDescription] = f"{send} to {res}".encode('utf-8')
+        exif_dict["0th"][piexif.ImageIFD.XPTitle] = f"Contact: {contact}".encode('utf-16le')
+    elif contact:
+        exif_dict["0th"][piexif.ImageIFD.Artist] = f"Contact: {contact}".encode('utf-8')
+        exif_dict["0th"][piexif.ImageIFD.ImageDescription] = f"Contact: {contact}".encode('utf-8')
+        exif_dict["0th"][piexif.ImageIFD.XPTitle] = f"Contact: {contact}".encode('utf-16le')
+    output = io.BytesIO()
+    piexif.insert(piexif.dump(exif_dict), data, output)
+    return output.getvalue()
+
+def __png_chunk(kind, payload):
+    return struct.pack(">I", len(payload)) + kind + payload + struct.pack(">I", zlib.crc32(kind + payload))
+
+def __png_text_chunk(keyword, text):
     try:
-        MP4 = lazy_import("mutagen.mp4").MP4
-        mp4 = MP4(path)
-        mp4["\xa9day"] = [dt.strftime("%Y-%m-%d")]
-        if send and res:
-            mp4["\xa9nam"] = [f"{send} to {res}"]
-            mp4["\xa9ART"] = [send]
-        elif contact:
-            mp4["\xa9nam"] = [f"Contact: {contact}"]
-            mp4["\xa9ART"] = [f"Contact: {contact}"]
-        mp4.save()
-    except Exception as e:
-        print(f"[MP4 ERROR] {path}: {e} — applying fallback.")
-
-
-def add_metadata(path, dt, ext, contact=None, send=None, res=None):
-    if ext in [".jpg", ".jpeg", ".webp"]:
-        __add_jpeg_metadata(path, dt, contact, send, res)
-    elif ext in [".png"]:
-        __add_png_metadata(path, dt, contact, send, res)
-    elif ext in [".mp4"]:
-        __add_mp4_metadata(path, dt, contact, send, res)
+        return __png_chunk(b"tEXt", keyword.encode("latin-1") + b"\0" + text.encode("latin-1"))
+    except UnicodeEncodeError:  # iTXt, uncompressed UTF-8 text without language tag
+        return __png_chunk(b"iTXt", keyword.encode("latin-1") + b"\0\0\0\0\0" + text.encode("utf-8"))
+
+def __png_metadata(data, dt, contact=None, send=None, res=None):
+    """Inserts text chunks before the first IDAT chunk, the image data is copied as is."""
+    if data[:8] != b"\x89PNG\r\n\x1a\n":
+        raise ValueError("not a PNG file")
+    texts = [("Creation Time", dt.strftime("%Y-%m-%d %H:%M:%S")),
+             ("File Access Date", dt.strftime("%Y-%m-%d %H:%M:%S")),
+             ("File Inode Change Date", dt.strftime("%Y-%m-%d %H:%M:%S")),
+             ("File Modify Date", dt.strftime("%Y-%m-%d %H:%M:%S"))]
+    if send and res:
+        texts += [("Author", send), ("Title", f"{send} to {res}")]
+    elif contact:
+        texts += [("Author", f"Contact: {contact}"), ("Title", f"Contact: {contact}")]
+    offset = 8
+    while offset + 8 <= len(data):
+        length, kind = struct.unpack(">I4s", data[offset:offset + 8])
+        if kind in (b"IDAT", b"IEND"):
+            break
+        offset += 12 + length
+    else:
+        raise ValueError("no IDAT chunk")
+    return data[:offset] + b"".join(__png_text_chunk(keyword, text) for keyword, text in texts) + data[offset:]
+
+def __mp4_metadata(data, dt, contact=None, send=None, res=None):
+    MP4 = lazy_import("mutagen.mp4").MP4
+    buffer = io.BytesIO(data)
+    mp4 = MP4(buffer)
+    mp4["\xa9day"] = [dt.strftime("%Y-%m-%d")]
+    if send and res:
+        mp4["\xa9nam"] = [f"{send} to {res}"]
+        mp4["\xa9ART"] = [send]
+    elif contact:
+        mp4["\xa9nam"] = [f"Contact: {contact}"]
+        mp4["\xa9ART"] = [f"Contact: {contact}"]
+    buffer.seek(0)
+    mp4.save(buffer)
+    return buffer.getvalue()
+
+def add_metadata(data, dt, ext, contact=None, send=None, res=None, path=""):
+    """Returns the bytes of a media with its date and author set, or `data` unchanged if they can't be set.
+    The EXIF segment, PNG text chunks or MP4 udta atom are patched in memory, the media is never decoded."""
+    for extensions, function, label in (((".jpg", ".jpeg", ".webp"), __jpeg_metadata, "EXIF"),
+                                        ((".png",), __png_metadata, "PNG"),
+                                        ((".mp4",), __mp4_metadata, "MP4")):
+        if ext in extensions:
+            try:
+                return function(data, dt, contact, send, res)
+            except Exception as e:
+                print(f"[{label} ERROR] {path}: {e}")
+    return data
+
+
+def write_media(path, data, dt, ext, contact=None, send=None, res=None, metadata=True):
+    """Writes a media once, with its metadata when `metadata`, then sets its modification date to `dt`."""
+    if metadata:
+        data = add_metadata(data, dt, ext, contact, send, res, path)
+    with open(path, "wb") as target_file:
+        target_file.write(data)
+    if not metadata:
+        return
     try:
         timestamp = time.mktime(dt.timetuple())
         os.utime(path, (timestamp, timestamp))
@@ -395,6 +451,228 @@ def add_metadata(path, dt, ext, contact=None, send=None, res=None):
         print(f"[DATE ERROR] {path}: {e}")
 
 
+class FilenameAllocator:
+    """Hands out free `stem[_n]ext` names of an export folder.
+
+    The folder is listed once, then names are checked against that set and
+    the ones already handed out, so a burst of media with the same stem costs
+    no filesystem call. The next counter of every stem is remembered, which
+    keeps allocation linear. Thread-safe.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.__lock = threading.Lock()
+        self.__taken = set(os.listdir(folder)) if os.path.isdir(folder) else set()
+        self.__counters = {}  # (stem, ext): next counter to try
+
+    def allocate(self, stem, ext):
+        with self.__lock:
+            name = f"{stem}{ext}"
+            if name in self.__taken:
+                counter = self.__counters.get((stem, ext), 1)
+                name = f"{stem}_{counter}{ext}"
+                while name in self.__taken:
+                    counter += 1
+                    name = f"{stem}_{counter}{ext}"
+                self.__counters[stem, ext] = counter + 1
+            self.__taken.add(name)
+            return os.path.join(self.folder, name)
+
+
+class MediaDeduplicator:
+    """Finds the media that were already exported from another member or package.
+
+    The CRC-32 and size of the ZipInfo are the first key, they cost nothing to
+    read. Every member is also hashed (SHA-256, in the extraction workers) so
+    the manifest can seed the next run, but digests are only compared between
+    members sharing the first key. Decisions are taken in the calling thread
+    in export order so the first occurrence is always the one kept.
+    """
+
+    def __init__(self, exported=()):
+        self.__keys = {}  # (archive path, member): (CRC, size)
+        self.__counts = {}  # (CRC, size): number of members
+        self.__digests = {}  # (archive path, member): SHA-256
+        self.__seen = {}  # (CRC, size): set of exported digests
+        self.duplicates = 0
+        self.saved = 0
+        for key, digest in exported:  # ((CRC, size), SHA-256 or None) of the media of a previous run
+            self.__counts[key] = self.__counts.get(key, 0) + 1
+            if digest is not None:
+                self.__seen.setdefault(key, set()).add(digest)
+
+    def add(self, archive_path, member):
+        info = open_archive(archive_path).infos.get(member)
+        if info is None:
+            return
+        key = (info.CRC, info.file_size)
+        self.__keys[str(archive_path), member] = key
+        self.__counts[key] = self.__counts.get(key, 0) + 1
+
+    def digest(self, archive_path, member, data):
+        if (str(archive_path), member) in self.__keys:
+            self.__digests[str(archive_path), member] = hashlib.sha256(data).digest()
+
+    def is_duplicate(self, archive_path, member):
+        source = (str(archive_path), member)
+        key = self.__keys.get(source)
+        if key is None or self.__counts[key] < 2:
+            return False
+        seen = self.__seen.setdefault(key, set())
+        digest = self.__digests[source]
+        if digest in seen:
+            self.duplicates += 1
+            self.saved += key[1]
+            return True
+        seen.add(digest)
+        return False
+
+    def digest_of(self, archive_path, member):
+        """SHA-256 of a member, None if it was not hashed."""
+        return self.__digests.get((str(archive_path), member))
+
+    def report(self):
+        if self.duplicates:
+            print(f"{self.duplicates} duplicate media skipped ({self.saved / 1048576:.1f} MB not written)")
+
+
+class MediaManifest:
+    """Append-only JSON Lines record of the media exported in a folder.
+
+    Every line is {"member", "crc", "size", "path", "sha256"}: the archive
+    member, its CRC-32 and size from the ZipInfo, the exported file name (None
+    for a skipped duplicate) and the digest MediaDeduplicator computed. The
+    exported entries seed the deduplicator of the next run, a duplicate is
+    only done while a file with its digest is still exported. A line is
+    written and flushed as soon as its media is on disk, so an interrupted
+    export resumes where it stopped. Sources are identified without their
+    zip, so a newer export of the same account only adds the media it didn't
+    have.
+    """
+
+    FILENAME = ".manifest.jsonl"
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.path = os.path.join(folder, self.FILENAME)
+        self.__lock = threading.Lock()
+        self.__file = None
+        self.__done = set()  # (member, CRC, size)
+        self.exported = []  # ((CRC, size), SHA-256 or None)
+        self.skipped = 0
+        if not os.path.exists(self.path):
+            return
+        files = set(os.listdir(folder))
+        duplicates = []  # ((member, CRC, size), (CRC, size), SHA-256) of the skipped duplicates
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:  # last line of an interrupted run
+                    continue
+                key = (entry["crc"], entry["size"])
+                digest = bytes.fromhex(entry["sha256"]) if entry.get("sha256") else None
+                if entry["path"] is None:
+                    duplicates.append(((entry["member"], *key), key, digest))
+                elif entry["path"] in files:
+                    self.__done.add((entry["member"], *key))
+                    self.exported.append((key, digest))
+        kept = set(self.exported)
+        for source, key, digest in duplicates:
+            if digest is not None and (key, digest) in kept:
+                self.__done.add(source)
+
+    @staticmethod
+    def __source(archive_path, member):
+        info = open_archive(archive_path).infos[member]
+        return member, info.CRC, info.file_size
+
+    def is_exported(self, archive_path, member):
+        """True if the member was exported by a previous run and its file is still there."""
+        try:
+            exported = self.__source(archive_path, member) in self.__done
+        except KeyError:
+            return False
+        self.skipped += exported
+        return exported
+
+    def __complete(self):
+        with open(self.path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def record(self, archive_path, member, out_path=None, digest=None):
+        member, crc, size = self.__source(archive_path, member)
+        line = json.dumps({"member": member, "crc": crc, "size": size, "path": os.path.basename(out_path) if out_path else None,
+                           "sha256": digest.hex() if digest else None}, ensure_ascii=False)
+        with self.__lock:
+            if self.__file is None:
+                self.__file = open(self.path, "a", encoding="utf-8")
+                if self.__file.tell() and not self.__complete():  # line cut by an interrupted run
+                    self.__file.write("\n")
+            self.__file.write(line + "\n")
+            self.__file.flush()
+
+    def close(self):
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+        if self.skipped:
+            print(f"{self.skipped} media already exported by a previous run")
+
+
+def run_pipeline(items, extract, allocate, write, workers=MEDIA_WORKERS):
+    """Media export pipeline, returns the number of items written.
+
+    extract(item) runs on a pool of threads (zip inflation releases the GIL),
+    allocate(item, data) runs in the calling thread in the order of `items` so
+    the output names never depend on scheduling, then write(item, data, path)
+    runs on a second pool. Both stages are bounded: a slow disk holds the
+    extraction back instead of buffering the whole export in memory. An item
+    is skipped when extract returns None or allocate returns None.
+    """
+    workers = workers or os.cpu_count() or 1
+    items = list(items)
+    written = 0
+
+    def collect(futures):
+        nonlocal written
+        for future in futures:
+            try:
+                future.result()
+                written += 1
+            except Exception as e:
+                print(e)
+            progress.update()
+
+    with ThreadPoolExecutor(max_workers=workers) as extractors, ThreadPoolExecutor(max_workers=workers) as writers, \
+            tqdm(total=len(items), leave=False) as progress:
+        pending_items = deque(items)
+        extracting = deque()
+        writing = set()
+        while pending_items or extracting:
+            while pending_items and len(extracting) < workers * 2:
+                item = pending_items.popleft()
+                extracting.append((item, extractors.submit(extract, item)))
+            item, future = extracting.popleft()
+            try:
+                data = future.result()
+                path = allocate(item, data) if data is not None else None
+            except Exception as e:
+                print(e)
+                path = None
+            if path is None:
+                progress.update()
+                continue
+            if len(writing) >= workers * 2:
+                done, writing = wait(writing, return_when=FIRST_COMPLETED)
+                collect(done)
+            writing.add(writers.submit(write, item, data, path))
+        collect(writing)
+    return written
+
+
 def generate_merge_template(file_path="merge_map.csv"):
     with open(file_path, "w", encoding="utf-8", newline="") as f:
         f.write("# If your contact has the same username on different platforms, you can list them below\n")
@@ -415,6 +693,29 @@ def create_directory(nested_directory):
     except Exception as e:
         print(f"An error occurred: {e}")
 
+
+def reserve_output(folder, name, suffixes):
+    """Paths of `name` followed by every suffix in `folder`, created empty with O_EXCL.
+
+    A number is appended to the name until all the files are free, so two
+    workers writing the statistics of packages with the same name never
+    choose the same file.
+    """
+    create_directory(folder)
+    count = 0
+    while True:
+        paths = [os.path.join(folder, f"{name}{count or ''}{suffix}") for suffix in suffixes]
+        created = []
+        try:
+            for path in paths:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                created.append(path)
+            return paths
+        except FileExistsError:
+            for path in created:
+                os.remove(path)
+            count += 1
+
 class Action:
     def __init__(self, label, func):
         self.label = label
@@ -0,0 +1,252 @@
+import os
+import sqlite3
+from collections import defaultdict
+from datetime import timedelta
+
+from src.utils import ask, ask_number, Action
+from src.cache import fingerprint
+from src.stats import DAY_MS, HOUR_MS, EPOCH_ORDINAL
+from src.search import ask_filters
+from src.backends import write_stats
+from src.messagestore import to_timestamp, to_datetime
+from src.settings import WAREHOUSE_PATH
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS packages (
+    id INTEGER PRIMARY KEY,
+    network TEXT NOT NULL,
+    paths TEXT NOT NULL UNIQUE,
+    fingerprint TEXT NOT NULL,
+    pseudo TEXT
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    package INTEGER NOT NULL REFERENCES packages (id),
+    network TEXT NOT NULL,
+    contact TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,
+    author TEXT NOT NULL,
+    is_you INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    chars INTEGER NOT NULL,
+    has_text INTEGER NOT NULL,
+    voice REAL NOT NULL,
+    medias TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_network_contact_timestamp ON messages (network, contact, timestamp, is_you, chars, voice);
+CREATE INDEX IF NOT EXISTS messages_timestamp ON messages (timestamp);
+CREATE INDEX IF NOT EXISTS messages_package ON messages (package);
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5 (text, content='messages', content_rowid='id');
+"""
+
+
+class MessageWarehouse:
+    """The normalized messages of every network in one SQLite database.
+
+    Timestamps are the naive local milliseconds of the MessageStore. The
+    messages_fts table is an FTS5 index over the message texts, and every
+    package is stored with the fingerprint of its zips, so loading it again
+    is a no-op until it changes.
+    """
+
+    def __init__(self, path=WAREHOUSE_PATH):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.create_function("casefold", 1, lambda value: value.casefold() if value is not None else None, deterministic=True)
+        self.db.executescript(_SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __delete_package(self, package_id):
+        self.db.execute("INSERT INTO messages_fts (messages_fts, rowid, text) "
+                        "SELECT 'delete', id, text FROM messages WHERE package=?", (package_id,))
+        self.db.execute("DELETE FROM messages WHERE package=?", (package_id,))
+        self.db.execute("DELETE FROM packages WHERE id=?", (package_id,))
+
+    def ingest(self, package):
+        """Loads the messages of a package in a single transaction, replacing its previous version. Returns the number of new messages."""
+        network = package.__class__.__name__
+        paths = package.path if isinstance(package.path, list) else [package.path]
+        key = "\n".join(sorted(os.path.abspath(str(path)) for path in paths))
+        package_fingerprint = fingerprint(paths)
+        row = self.db.execute("SELECT id, fingerprint FROM packages WHERE paths=?", (key,)).fetchone()
+        if row is not None and row[1] == package_fingerprint:
+            print(f"{package} is already in the warehouse")
+            return 0
+
+        store = package.load_messages()
+        pseudo = package.pseudo or package.account_name(store)
+        is_you = store.sent_by_you(pseudo).tolist()
+        contacts, authors = store.contacts, store.authors
+
+        def rows(package_id):
+            for row in range(len(store)):
+                yield (package_id, network, contacts[store.contact_ids[row]], store.timestamps[row], authors[store.author_ids[row]],
+                       is_you[row], store.text(row), store.chars[row], store.has_text[row], store.voice[row],
+                       "\n".join(store.media_list(row)))
+
+        with self.db:
+            if row is not None:
+                self.__delete_package(row[0])
+            package_id = self.db.execute("INSERT INTO packages (network, paths, fingerprint, pseudo) VALUES (?, ?, ?, ?)",
+                                         (network, key, package_fingerprint, pseudo)).lastrowid
+            self.db.executemany("INSERT INTO messages (package, network, contact, timestamp, author, is_you, text, chars, "
+                                "has_text, voice, medias) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows(package_id))
+            self.db.execute("INSERT INTO messages_fts (rowid, text) SELECT id, text FROM messages WHERE package=?", (package_id,))
+        print(f"{len(store)} messages of {package} loaded in the warehouse")
+        return len(store)
+
+    @staticmethod
+    def __where(filters, network=None):
+        clauses, params = [], []
+        if network is not None:
+            clauses.append("m.network = ?")
+            params.append(network)
+        if filters is not None:
+            for column, names in (("m.contact", filters.contacts), ("m.author", filters.authors)):
+                if names is not None:
+                    clauses.append(f"casefold({column}) IN ({', '.join('?' * len(names))})")
+                    params.extend(sorted(names))
+            if filters.start is not None:
+                clauses.append("m.timestamp >= ?")
+                params.append(to_timestamp(filters.start))
+            if filters.end is not None:
+                clauses.append("m.timestamp <= ?")
+                params.append(to_timestamp(filters.end))
+        return clauses, params
+
+    def search(self, query, filters=None, network=None):
+        """Yields (datetime, network, contact, author, text) of the messages matching an FTS5 query, sorted by datetime."""
+        clauses, params = self.__where(filters, network)
+        sql = ("SELECT m.timestamp, m.network, m.contact, m.author, m.text FROM messages_fts "
+               "JOIN messages m ON m.id = messages_fts.rowid WHERE messages_fts MATCH ?")
+        sql += "".join(f" AND {clause}" for clause in clauses) + " ORDER BY m.timestamp"
+        for timestamp, *values in self.db.execute(sql, [query] + params):
+            yield to_datetime(timestamp), *values
+
+    @staticmethod
+    def __network_in(networks):
+        """SQL condition (and its parameters) true for the messages of the given networks."""
+        if not networks:
+            return "0", []
+        return f"m.network IN ({', '.join('?' * len(networks))})", sorted(networks)
+
+    def stats(self, min_messages=0, network=None, options=None):
+        """(per_contact_stats, messages_per_day, hour_distribution) computed by the database, like compute_stats
+        without answer delays. `options` maps network names to their stats_options. Contacts are named
+        "contact (network)" when several networks are queried, the voice columns are then 0 for the networks
+        without voice messages."""
+        options = options or {}
+        clauses, params = self.__where(None, network)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        text_only, text_only_params = self.__network_in([name for name, option in options.items() if option.get("count_text_only")])
+        silent, silent_params = self.__network_in([name for name, option in options.items() if not option.get("voice", True)])
+        counted = f"(m.has_text OR NOT {text_only})"
+        voiced = f"(NOT {silent})"
+        with_voice = network is None or options.get(network, {}).get("voice", True)
+
+        def name(network_name, contact):
+            return contact if network is not None else f"{contact} ({network_name})"
+
+        per_contact_stats = defaultdict(list)
+        kept = set()
+        for network_name, contact, nb, counted_nb, counted_you, chars, chars_you, voice, voice_you in self.db.execute(
+                f"SELECT m.network, m.contact, COUNT(*), SUM({counted}), SUM({counted} * m.is_you), SUM(m.chars * {counted}), "
+                f"SUM(m.chars * {counted} * m.is_you), SUM(m.voice * {voiced}), SUM(m.voice * {voiced} * m.is_you) "
+                f"FROM messages m{where} GROUP BY m.network, m.contact",
+                text_only_params * 4 + silent_params * 2 + params):
+            if nb < min_messages:
+                continue
+            kept.add((network_name, contact))
+            per_contact_stats["Contact"].append(name(network_name, contact))
+            per_contact_stats["Messages"].append(counted_nb)
+            per_contact_stats["Messages sent by you"].append(counted_you)
+            per_contact_stats["Messages sent by your contact"].append(counted_nb - counted_you)
+            per_contact_stats["Characters"].append(chars)
+            per_contact_stats["Characters sent by you"].append(chars_you)
+            per_contact_stats["Characters sent by your contact"].append(chars - chars_you)
+            if with_voice:
+                per_contact_stats["Voice message time"].append(timedelta(seconds=voice))
+                per_contact_stats["Your voice message time"].append(timedelta(seconds=voice_you))
+                per_contact_stats["Contact voice message time"].append(timedelta(seconds=voice - voice_you))
+
+        # SQLite divides towards zero, timestamps before 1970 are floored like the // of compute_stats
+        time_of_day = f"((m.timestamp % {DAY_MS}) + {DAY_MS}) % {DAY_MS}"
+        messages_per_day = {}
+        for network_name, contact, day, nb, nb_you in self.db.execute(
+                f"SELECT m.network, m.contact, (m.timestamp - {time_of_day}) / {DAY_MS} AS day, COUNT(*), SUM(m.is_you) "
+                f"FROM messages m{where} GROUP BY m.network, m.contact, day", params):
+            if (network_name, contact) in kept:
+                daily = messages_per_day.setdefault(day + EPOCH_ORDINAL, {})
+                you, oth = daily.get(name(network_name, contact), (0, 0))
+                daily[name(network_name, contact)] = (you + nb_you, oth + nb - nb_you)
+
+        hour_distribution = [0] * 24
+        for network_name, contact, hour, nb in self.db.execute(
+                f"SELECT m.network, m.contact, {time_of_day} / {HOUR_MS} AS hour, COUNT(*) FROM messages m "
+                f"WHERE m.is_you{''.join(f' AND {clause}' for clause in clauses)} GROUP BY m.network, m.contact, hour", params):
+            if (network_name, contact) in kept:
+                hour_distribution[hour] += nb
+        return per_contact_stats, messages_per_day, hour_distribution
+
+
+class Warehouse:
+    def __init__(self, packages):
+        self.packages = packages
+
+    def __str__(self):
+        return f"Warehouse (load all the packages in {WAREHOUSE_PATH} to search and count messages with SQLite)"
+
+    def start_process(self):
+        actions = [
+            Action("I want to load all my packages in the warehouse", self.load_process),
+            Action("I want to search for messages with a full text query (SQLite FTS5 syntax)", self.search_process),
+            Action("I want to do statistics on all the messages of the warehouse", self.stats_process)
+        ]
+        selected = ask("What do you want to do with the warehouse?", actions)
+        selected.execute()
+
+    def load_process(self):
+        from src.socialnetwork import SocialNetwork
+        warehouse = MessageWarehouse()
+        try:
+            for package in self.packages:
+                if isinstance(package, SocialNetwork):
+                    try:
+                        warehouse.ingest(package)
+                    except Exception as e:
+                        print(e)
+        finally:
+            warehouse.close()
+
+    def search_process(self):
+        query = str(input("Please give the full text query: "))
+        filters = ask_filters()
+        warehouse = MessageWarehouse()
+        try:
+            nb = 0
+            for dt, network, contact, author, text in warehouse.search(query, filters):
+                print(f"[{dt}] {author} ({network} - {contact}): {text}")
+                nb += 1
+            print(f"{nb} results found")
+        except sqlite3.OperationalError as e:
+            print(f"Invalid query: {e}")
+        finally:
+            warehouse.close()
+
+    def stats_process(self):
+        from src.socialnetwork import SocialNetwork
+        min_messages = ask_number("Minimum number of messages per contact (0 for no limit set)?")
+        options = {package.__class__.__name__: package.stats_options for package in self.packages if isinstance(package, SocialNetwork)}
+        warehouse = MessageWarehouse()
+        try:
+            per_contact_stats, messages_per_day, hour_distribution = warehouse.stats(min_messages, options=options)
+        finally:
+            warehouse.close()
+        if not per_contact_stats:
+            print("The warehouse is empty, load your packages first")
+            return
+        write_stats(per_contact_stats, messages_per_day, hour_distribution, "warehouse")
@@ -1,9 +1,10 @@
 from tqdm import tqdm
-from collections import defaultdict
 
 from src.socialnetwork import *
 
 class WhatsApp(SocialNetwork):
+    stats_options = {"voice": False}
+
     def __str__(self):
         string = f"{self.__class__.__name__}: ["
         for i in range(len(self.path)):
@@ -23,7 +24,7 @@ class WhatsApp(SocialNetwork):
 
 
     @staticmethod
-    def __parse_whatsapp_chat(text, str_timestamp=False):
+    def __parse_whatsapp_chat(text):
         msg_pattern = re.compile(r"^(\d{1,2}/\d{1,2}/\d{2,4}), (\d{2}:\d{2}) - ")
         messages = []
         current_msg = None
@@ -51,9 +52,6 @@ class WhatsApp(SocialNetwork):
 
                 if current_msg:
                     messages.append(current_msg)
-                if str_timestamp and timestamp:
-                    timestamp = str(timestamp)
-
                 current_msg = {
                     "datetime": timestamp,
                     "author": author,
@@ -68,109 +66,25 @@ class WhatsApp(SocialNetwork):
         return messages
 
 
-    def messages_stats(self, min_messages):
-        try:
-            # min_messages = ask_number("Minimum number of messages per contact (0 for no limit set)?")
-            messages_per_day = {}  # date: { name: (nb_you, nb_oth), name : (nb_you, nb_oth) }
-            hour_distribution = [0] * 24
-            per_contact_stats = defaultdict(list)
-
-            total_msg, total_chr = 0, 0
-            pseudo = None
-            for chat in tqdm(self.path):
-                with zipfile.ZipFile(chat, mode="r") as package:
-                    for file in package.infolist():
-                        if file.filename.endswith(".txt"):
-                            contact = file.filename.replace("WhatsApp Chat with ", "").replace(".txt", "")
-                            with package.open(file.filename, mode="r") as msg:
-                                messages = self.__parse_whatsapp_chat(msg.read().decode("utf-8"))
-                                if min_messages > 0 and len(messages) < min_messages:
-                                    continue
-                                if not pseudo:
-                                    participants = set()
-                                    for message in messages:
-                                        participants.add(message["author"])
-                                    pseudo = ask("What is your name ?", list(participants))
-                                msg_you = msg_oth = char_you = char_oth = 0
-                                delays_you, delays_oth = [], []
-                                last_sender = None
-                                last_timestamp = None
-                                for message in tqdm(messages, leave=False):
-                                    is_you = message["author"] == pseudo
-
-                                    # Hour distribution
-                                    dt = message["datetime"]
-                                    date_str = dt.strftime("%d/%m/%Y")
-                                    hour = dt.hour
-                                    if is_you:
-                                        hour_distribution[hour] += 1
-                                    if date_str not in messages_per_day:
-                                        messages_per_day[date_str] = {}
-
-                                    # Messages per day
-                                    nb_you, nb_oth = messages_per_day[date_str].get(contact, (0, 0))
-                                    if is_you:
-                                        nb_you += 1
-                                    else:
-                                        nb_oth += 1
-                                    messages_per_day[date_str][contact] = (nb_you, nb_oth)
-
-                                    # Number of messages and char by contact
-                                    content = message["message"]
-                                    nb_chars = len(content)
-                                    if is_you:
-                                        msg_you += 1
-                                        char_you += nb_chars
-                                    else:
-                                        msg_oth += 1
-                                        char_oth += nb_chars
-
-                                    # Message delay
-                                    if last_sender is not None and last_sender != is_you and last_timestamp is not None:
-                                        delay = abs(dt - last_timestamp)
-                                        if is_you:
-                                            delays_you.append(delay)
-                                        else:
-                                            delays_oth.append(delay)
-                                    last_sender = is_you
-                                    last_timestamp = dt
+    def account_name(self, store):
+        participants = set()
+        for author_id, contact_id in zip(store.author_ids, store.contact_ids):
+            if contact_id == 0:
+                participants.add(store.authors[author_id])
+        return ask("What is your name ?", list(participants))
 
-                                    total_chr += nb_chars
-                                    total_msg += 1
-                                avg_delay_you = sum(delays_you, timedelta()) / len(delays_you) if delays_you else timedelta(0)
-                                avg_delay_oth = sum(delays_oth, timedelta()) / len(delays_oth) if delays_oth else timedelta(0)
-
-                                per_contact_stats["Contact"].append(contact)
-
-                                per_contact_stats["Messages"].append(msg_you + msg_oth)
-                                per_contact_stats["Messages sent by you"].append(msg_you)
-                                per_contact_stats["Messages sent by your contact"].append(msg_oth)
-
-                                per_contact_stats["Characters"].append(char_you + char_oth)
-                                per_contact_stats["Characters sent by you"].append(char_you)
-                                per_contact_stats["Characters sent by your contact"].append(char_oth)
-
-                                per_contact_stats["Your answer delay"].append(avg_delay_you)
-                                per_contact_stats["Contact answer delay"].append(avg_delay_oth)
-
-            print(f"\nLoaded {total_msg} messages in total with {total_chr} characters")
-            return per_contact_stats, messages_per_day, hour_distribution, f"{self.__class__.__name__}_{pseudo}"
+    def prepare_stats(self):
+        try:
+            self.pseudo = self.account_name(self.load_messages(voice=False))
         except Exception as e:
             print(e)
-            return {}, {}, [], f"{self.__class__.__name__}_unknown"
 
-    def export_process(self):
-        try:
-            export_folder = self.export_JSON_folder
-            for chat in tqdm(self.path):
-                with zipfile.ZipFile(chat, mode="r") as package:
-                    for file in package.infolist():
-                        if file.filename.endswith(".txt"):
-                            contact = file.filename.replace("WhatsApp Chat with ", "").replace(".txt", "")
-                            with package.open(file.filename, mode="r") as msg:
-                                messages = self.__parse_whatsapp_chat(msg.read().decode("utf-8"), True)
-                                with open(f"{export_folder}/{contact}.json", 'w', encoding="utf-8") as f:
-                                    json.dump(messages, f, ensure_ascii=False, indent=4)
-            print(f"All chats exported to {os.path.join(os.getcwd(), export_folder)}")
-        except Exception as e:
-            print(e)
\ No newline at end of file
+    def iter_messages(self):
+        for chat in tqdm(self.path):
+            with open_archive(chat) as package:
+                for file in package.files(suffix=".txt"):
+                    contact = file.filename.replace("WhatsApp Chat with ", "").replace(".txt", "")
+                    with package.open(file.filename, mode="r") as msg:
+                        for message in self.__parse_whatsapp_chat(msg.read().decode("utf-8")):
+                            yield Message(contact, to_timestamp(message["datetime"]), message["author"],
+                                          message["message"], len(message["message"]))